@@ -0,0 +1,364 @@
+"""
+Online backups for the Hospital Management System database
+
+Usage:
+    python backup.py backup  [--db hospital.db] [--dir backups] [--keep 7]
+    python backup.py list    [--dir backups]
+    python backup.py restore SNAPSHOT [--db hospital.db]
+    python backup.py bench   [--size-mb 2048]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+DB_PATH = 'hospital.db'
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 7               # snapshots kept after rotation
+BACKUP_PAGES_PER_STEP = 256   # pages copied per step (1 MB with 4 KB pages)
+BACKUP_STEP_SLEEP = 0.005     # seconds the source is left alone between steps
+BACKUP_MAX_RESTARTS = 3       # see backup_database()
+BACKUP_INTERVAL_HOURS = 6
+BACKUP_RETRY_SECONDS = 300    # wait before retrying a failed scheduled backup
+# Tables whose newer rows survive a restore, mapped to a condition matching the
+# snapshot's rows that may have changed since (re-copied from the live database)
+RESTORE_KEEP_TABLES = {
+    'audit_log': None,                        # append-only
+    'reminder_outbox': "status = 'Pending'",  # Pending rows are later marked Sent
+}
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def snapshot_name(db_path=DB_PATH):
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+
+
+def integrity_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in result] == ['ok']
+
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    if not os.path.isdir(backup_dir):
+        return []
+    snapshots = [os.path.join(backup_dir, f) for f in os.listdir(backup_dir) if f.endswith('.db')]
+    return sorted(snapshots, key=os.path.getmtime, reverse=True)
+
+
+def rotate_snapshots(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    removed = []
+    for path in list_snapshots(backup_dir)[keep:]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def _copy(source, target, pages, step_sleep, max_restarts, stats):
+    last_remaining = [None]
+    last_call = [time.perf_counter()]
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        # Time spent inside the step, i.e. while the source read lock was held
+        stats['max_step_seconds'] = max(stats['max_step_seconds'], now - last_call[0])
+        stats['steps'] += 1
+        stats['pages'] = total
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            stats['restarts'] += 1
+            if max_restarts is not None and stats['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining[0] = remaining
+        if step_sleep:
+            time.sleep(step_sleep)
+        last_call[0] = time.perf_counter()
+
+    source.backup(target, pages=pages, progress=progress)
+
+
+def backup_database(db_path=DB_PATH, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP,
+                    pages=BACKUP_PAGES_PER_STEP, step_sleep=BACKUP_STEP_SLEEP,
+                    max_restarts=BACKUP_MAX_RESTARTS):
+    """Take a verified snapshot of db_path while the app keeps running.
+
+    The copy uses the sqlite3 online backup API a few pages at a time, so the
+    source is only read-locked for one short step at a time. SQLite restarts a
+    step-wise backup whenever another connection writes to the source; after
+    max_restarts of those the copy is finished in a single step instead, which
+    reads one consistent WAL snapshot and does not block writers either.
+
+    Returns a dict of stats (path, size, throughput, worst step time, ...).
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    final_path = os.path.join(backup_dir, snapshot_name(db_path))
+    partial_path = final_path + '.partial'
+
+    stats = {'path': final_path, 'steps': 0, 'pages': 0, 'restarts': 0,
+             'single_step_fallback': False, 'max_step_seconds': 0.0}
+
+    started = time.perf_counter()
+    source = sqlite3.connect(db_path, timeout=30)
+    target = sqlite3.connect(partial_path)
+    try:
+        try:
+            _copy(source, target, pages, step_sleep, max_restarts, stats)
+        except _TooManyRestarts:
+            stats['single_step_fallback'] = True
+            step_started = time.perf_counter()
+            source.backup(target)
+            stats['max_step_seconds'] = max(stats['max_step_seconds'],
+                                            time.perf_counter() - step_started)
+    finally:
+        target.close()
+        source.close()
+    stats['seconds'] = time.perf_counter() - started
+
+    if not integrity_check(partial_path):
+        os.remove(partial_path)
+        raise BackupError(f"Snapshot of {db_path} failed PRAGMA integrity_check")
+    os.replace(partial_path, final_path)
+
+    stats['size_bytes'] = os.path.getsize(final_path)
+    stats['mb_per_second'] = stats['size_bytes'] / 1e6 / stats['seconds'] if stats['seconds'] else 0.0
+    stats['rotated'] = rotate_snapshots(backup_dir, keep) if keep is not None else []
+    return stats
+
+
+def _table_sql(conn, table):
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row[0] if row else None
+
+
+def restore_database(snapshot_path, db_path=DB_PATH, backup_dir=BACKUP_DIR, keep_tables=RESTORE_KEEP_TABLES):
+    """Replace the contents of db_path with snapshot_path.
+
+    The snapshot is verified first and the current database is saved to
+    backup_dir as a safety copy. The restore itself is a single backup step
+    into the live file, so connections already open keep working and see the
+    restored data on their next transaction. For each of keep_tables (with an
+    integer id), rows added after the snapshot was taken, and live copies of
+    snapshot rows matching the table's condition, are read just before that
+    step and written back afterwards.
+    """
+    if not integrity_check(snapshot_path):
+        raise BackupError(f"{snapshot_path} failed PRAGMA integrity_check, refusing to restore")
+
+    safety = backup_database(db_path, backup_dir, keep=None) if os.path.exists(db_path) else None
+
+    started = time.perf_counter()
+    source = sqlite3.connect(snapshot_path)
+    target = sqlite3.connect(db_path, timeout=30)
+    try:
+        kept = {}
+        for table, changed in keep_tables.items():
+            table_sql = _table_sql(target, table)
+            if table_sql is None:
+                continue
+            last_id, changed_ids = 0, []
+            if _table_sql(source, table):
+                last_id = source.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+                if changed:
+                    changed_ids = [row[0] for row in source.execute(f"SELECT id FROM {table} WHERE {changed}")]
+            cursor = target.execute(f"SELECT * FROM {table} WHERE id > ? ORDER BY id", (last_id,))
+            columns = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+            for start in range(0, len(changed_ids), 500):
+                chunk = changed_ids[start:start + 500]
+                rows += target.execute(f"SELECT * FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})",
+                                       chunk).fetchall()
+            kept[table] = (table_sql, columns, rows, 'REPLACE' if changed else 'IGNORE')
+        target.commit()
+
+        source.backup(target)
+
+        with target:
+            for table, (table_sql, columns, rows, conflict) in kept.items():
+                if _table_sql(target, table) is None:
+                    target.execute(table_sql)
+                target.executemany(
+                    f"INSERT OR {conflict} INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})",
+                    rows
+                )
+    finally:
+        target.close()
+        source.close()
+    return {'path': db_path, 'seconds': time.perf_counter() - started,
+            'safety_snapshot': safety['path'] if safety else None,
+            'kept_rows': {table: len(rows) for table, (_, _, rows, _) in kept.items()}}
+
+
+class BackupScheduler:
+    """Background thread that snapshots the database every interval_hours.
+
+    The schedule follows the newest snapshot in backup_dir rather than the
+    process start, so a server restarted often still backs up on time and a
+    stale backup_dir is refreshed right after startup.
+    """
+
+    def __init__(self, db_path=DB_PATH, backup_dir=BACKUP_DIR, interval_hours=BACKUP_INTERVAL_HOURS,
+                 keep=BACKUP_KEEP):
+        self.db_path = os.path.abspath(db_path)
+        self.backup_dir = os.path.abspath(backup_dir)
+        self.interval = interval_hours * 3600
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.last_result = None
+        self.last_error = None
+        self.last_run = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
+        self.thread.start()
+
+    def run_now(self):
+        # Serialise scheduled and manual backups
+        with self.lock:
+            self.last_run = datetime.now()
+            try:
+                self.last_result = backup_database(self.db_path, self.backup_dir, self.keep)
+                self.last_error = None
+            except (sqlite3.Error, OSError, BackupError) as e:
+                self.last_error = str(e)
+                raise
+            return self.last_result
+
+    def seconds_until_due(self):
+        snapshots = list_snapshots(self.backup_dir)
+        if not snapshots:
+            return 0
+        return max(self.interval - (time.time() - os.path.getmtime(snapshots[0])), 0)
+
+    def _run(self):
+        delay = self.seconds_until_due()
+        while not self.stopped.wait(delay):
+            # A manual backup taken meanwhile moves the next scheduled one
+            delay = self.seconds_until_due()
+            if delay > 0:
+                continue
+            try:
+                self.run_now()
+                delay = self.seconds_until_due()
+            except (sqlite3.Error, OSError, BackupError):
+                delay = min(BACKUP_RETRY_SECONDS, self.interval)  # recorded in last_error
+
+    def stop(self):
+        self.stopped.set()
+
+
+def _create_bench_db(path, size_mb):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE filler (id INTEGER PRIMARY KEY, payload BLOB)")
+    conn.execute("CREATE TABLE writes (id INTEGER PRIMARY KEY, ts REAL)")
+    row_size = 4000
+    rows = size_mb * 1_000_000 // row_size
+    batch = 2500
+    for start in range(0, rows, batch):
+        conn.executemany("INSERT INTO filler (payload) VALUES (?)",
+                         ((os.urandom(row_size),) for _ in range(min(batch, rows - start))))
+        conn.commit()
+    conn.close()
+
+
+def benchmark(size_mb=2048, write_interval=0.05):
+    """Measure backup and restore time and the worst writer stall on a generated database."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        backup_dir = os.path.join(tmp, 'backups')
+        print(f"Generating {size_mb} MB database in {tmp} ...")
+        _create_bench_db(db_path, size_mb)
+
+        stalls = []
+        stop = threading.Event()
+
+        def writer():
+            conn = sqlite3.connect(db_path, timeout=60)
+            while not stop.is_set():
+                started = time.perf_counter()
+                conn.execute("INSERT INTO writes (ts) VALUES (?)", (time.time(),))
+                conn.commit()
+                stalls.append(time.perf_counter() - started)
+                time.sleep(write_interval)
+            conn.close()
+
+        # The writer keeps committing through both the backup and the restore
+        # over the live file; its rows stand in for the audit log
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            stats = backup_database(db_path, backup_dir)
+            time.sleep(1)
+            restore = restore_database(stats['path'], db_path, backup_dir, keep_tables={'writes': None})
+        finally:
+            stop.set()
+            thread.join()
+
+    stalls.sort()
+    print(f"Snapshot size:          {stats['size_bytes'] / 1e6:,.0f} MB")
+    print(f"Backup time:            {stats['seconds']:.2f} s ({stats['mb_per_second']:,.0f} MB/s)")
+    print(f"Steps / restarts:       {stats['steps']} / {stats['restarts']}"
+          f"{' (finished in a single step)' if stats['single_step_fallback'] else ''}")
+    print(f"Longest backup step:    {stats['max_step_seconds'] * 1000:.1f} ms")
+    print(f"Writer commits:         {len(stalls)}")
+    if stalls:
+        print(f"Writer commit p50/max:  {stalls[len(stalls) // 2] * 1000:.1f} ms / {stalls[-1] * 1000:.1f} ms")
+    print(f"Restore time:           {restore['seconds']:.2f} s over the live database "
+          f"({restore['kept_rows'].get('writes', 0)} newer writer rows kept)")
+    return stats, stalls, restore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online backups of the hospital database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help="take a verified snapshot now")
+    backup_parser.add_argument('--db', default=DB_PATH)
+    backup_parser.add_argument('--dir', default=BACKUP_DIR)
+    backup_parser.add_argument('--keep', type=int, default=BACKUP_KEEP)
+
+    list_parser = subparsers.add_parser('list', help="list snapshots, newest first")
+    list_parser.add_argument('--dir', default=BACKUP_DIR)
+
+    restore_parser = subparsers.add_parser('restore', help="restore the database from a snapshot")
+    restore_parser.add_argument('snapshot')
+    restore_parser.add_argument('--db', default=DB_PATH)
+    restore_parser.add_argument('--dir', default=BACKUP_DIR)
+
+    bench_parser = subparsers.add_parser('bench', help="measure backup, restore and writer stall")
+    bench_parser.add_argument('--size-mb', type=int, default=2048)
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        stats = backup_database(args.db, args.dir, args.keep)
+        print(f"Wrote {stats['path']} ({stats['size_bytes'] / 1e6:,.1f} MB in {stats['seconds']:.2f} s, "
+              f"longest step {stats['max_step_seconds'] * 1000:.1f} ms)")
+    elif args.command == 'list':
+        for path in list_snapshots(args.dir):
+            print(f"{path}  {os.path.getsize(path) / 1e6:,.1f} MB")
+    elif args.command == 'restore':
+        result = restore_database(args.snapshot, args.db, args.dir)
+        print(f"Restored {args.db} in {result['seconds']:.2f} s "
+              f"(previous contents saved to {result['safety_snapshot']}, "
+              f"newer rows kept: {result['kept_rows']})")
+    elif args.command == 'bench':
+        benchmark(args.size_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,22 @@ from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 from streamlit_option_menu import option_menu
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import random
 import time
+import json
+import threading
+import heapq
+import atexit
+import os
+import functools
+import itertools
+import zlib
+from difflib import SequenceMatcher
+from backup import BackupScheduler, BackupError, list_snapshots, restore_database
+
+# Start of this script run, for the interaction latency panel
+script_started = time.perf_counter()
 
 # Set page configuration
 st.set_page_config(
@@ -36,11 +50,15 @@ if 'user' not in st.session_state:
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
 
-# Initialize database
+# Initialize database (once per server process, not on every rerun)
+@st.cache_resource
 def init_db():
     conn = sqlite3.connect('hospital.db')
     cursor = conn.cursor()
     
+    # WAL lets readers (reports, online backups) run without blocking writers
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
     # Create patients table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS patients (
@@ -57,6 +75,25 @@ def init_db():
         )
     ''')
     
+    # Create blocking keys for duplicate patient detection. Keys are derived
+    # data: a table in an older layout is dropped and rebuilt by backfill_patient_block_keys.
+    cursor.execute("SELECT name FROM pragma_table_info('patient_block_keys')")
+    columns = [row[0] for row in cursor.fetchall()]
+    if columns and 'name' not in columns:
+        cursor.execute("DROP TABLE patient_block_keys")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patient_block_keys (
+            block_key TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            patient_id INTEGER NOT NULL,
+            PRIMARY KEY (block_key, gender, age, name, patient_id),
+            FOREIGN KEY (patient_id) REFERENCES patients (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_block_keys_patient ON patient_block_keys (patient_id)")
+    
     # Create doctors table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS doctors (
@@ -86,6 +123,7 @@ def init_db():
             FOREIGN KEY (doctor_id) REFERENCES doctors (id)
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_status_date ON appointments (status, date, time)")
     
     # Create bills table
     cursor.execute('''
@@ -115,6 +153,55 @@ def init_db():
         )
     ''')
     
+    # Create append-only audit log table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            username TEXT,
+            action TEXT NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id INTEGER,
+            before_value TEXT,
+            after_value TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_log (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log (entity, entity_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_username ON audit_log (username, timestamp)")
+    # The schema itself rejects changes to recorded events
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS audit_log_no_update BEFORE UPDATE ON audit_log
+        BEGIN
+            SELECT RAISE(ABORT, 'audit_log is append-only');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS audit_log_no_delete BEFORE DELETE ON audit_log
+        BEGIN
+            SELECT RAISE(ABORT, 'audit_log is append-only');
+        END
+    ''')
+    
+    # Create reminder outbox table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            appointment_id INTEGER NOT NULL,
+            remind_at TEXT NOT NULL,
+            patient_name TEXT,
+            phone TEXT,
+            email TEXT,
+            message TEXT,
+            status TEXT DEFAULT 'Pending',
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_date TEXT,
+            UNIQUE (appointment_id, remind_at),
+            FOREIGN KEY (appointment_id) REFERENCES appointments (id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reminder_outbox_status ON reminder_outbox (status, id)")
+    
     # Insert default admin user if not exists
     cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
     if cursor.fetchone()[0] == 0:
@@ -144,6 +231,9 @@ def load_data():
     st.session_state.bills = pd.read_sql_query("SELECT * FROM bills", conn).to_dict('records')
     
     conn.close()
+    
+    # Tables derived from the lists above are rebuilt once per load
+    st.session_state.data_version = st.session_state.get('data_version', 0) + 1
 
 # Initialize database and load data
 init_db()
@@ -184,12 +274,603 @@ def create_user(username, password, role):
             (username, hashed_password, role)
         )
         conn.commit()
+        user_id = cursor.lastrowid
         conn.close()
+        audit('create', 'user', user_id, after={'username': username, 'role': role})
         return True
     except sqlite3.IntegrityError:
         conn.close()
         return False
 
+# Audit logging
+AUDIT_FLUSH_INTERVAL = 2.0  # seconds between background flushes
+AUDIT_BATCH_SIZE = 200      # flush early once this many events are buffered
+
+# Events are buffered in memory and written to audit_log in batches by a
+# background thread; close() runs at exit so nothing buffered is lost
+class AuditLogger:
+    def __init__(self, db_path='hospital.db', flush_interval=AUDIT_FLUSH_INTERVAL,
+                 batch_size=AUDIT_BATCH_SIZE):
+        self.db_path = os.path.abspath(db_path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer = []
+        self.buffer_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, username, action, entity, entity_id=None, before=None, after=None):
+        event = (
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            username,
+            action,
+            entity,
+            entity_id,
+            json.dumps(before, default=str) if before is not None else None,
+            json.dumps(after, default=str) if after is not None else None,
+        )
+        with self.buffer_lock:
+            self.buffer.append(event)
+            if len(self.buffer) >= self.batch_size:
+                self.wakeup.set()
+
+    def flush(self):
+        # flush_lock keeps batches in order if the flusher thread and a
+        # caller (e.g. the audit page) flush at the same time
+        with self.flush_lock:
+            with self.buffer_lock:
+                events, self.buffer = self.buffer, []
+            if not events:
+                return 0
+
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                with conn:
+                    conn.executemany('''
+                        INSERT INTO audit_log (timestamp, username, action, entity, entity_id, before_value, after_value)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', events)
+            except sqlite3.Error:
+                # Put the batch back in front of anything recorded meanwhile
+                with self.buffer_lock:
+                    self.buffer[:0] = events
+                raise
+            finally:
+                conn.close()
+            return len(events)
+
+    def pending(self):
+        with self.buffer_lock:
+            return len(self.buffer)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # events were re-queued, retry on the next tick
+
+    def close(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.flush()
+
+# One logger per server process, shared by every session and rerun
+@st.cache_resource
+def get_audit_logger():
+    return AuditLogger()
+
+def audit(action, entity, entity_id=None, before=None, after=None):
+    user = st.session_state.get('user')
+    username = user['username'] if user else None
+    get_audit_logger().record(username, action, entity, entity_id, before, after)
+
+def query_audit_log(username=None, entity=None, action=None, entity_id=None,
+                    start_date=None, end_date=None, limit=500):
+    # Make sure buffered events are visible to the auditor
+    get_audit_logger().flush()
+
+    conditions = []
+    params = []
+    if username:
+        conditions.append("username = ?")
+        params.append(username)
+    if entity:
+        conditions.append("entity = ?")
+        params.append(entity)
+    if action:
+        conditions.append("action = ?")
+        params.append(action)
+    if entity_id:
+        conditions.append("entity_id = ?")
+        params.append(entity_id)
+    if start_date:
+        conditions.append("timestamp >= ?")
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date:
+        conditions.append("timestamp < ?")
+        params.append((end_date + timedelta(days=1)).strftime('%Y-%m-%d'))
+
+    query = "SELECT * FROM audit_log"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params.append(limit)
+
+    conn = sqlite3.connect('hospital.db')
+    audit_df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+    return audit_df
+
+# Backups
+# One scheduler per server process; it snapshots hospital.db every few hours
+@st.cache_resource
+def get_backup_scheduler():
+    return BackupScheduler()
+
+get_backup_scheduler()
+
+# Analytics snapshot
+ANALYTICS_TABLES = ['patients', 'doctors', 'appointments', 'bills']
+ANALYTICS_REFRESH_INTERVAL = 30        # seconds between incremental refreshes
+ANALYTICS_FULL_REFRESH_INTERVAL = 3600  # seconds between full rebuilds
+ANALYTICS_UPDATED_ENTITIES = {'appointment': 'appointments', 'bill': 'bills'}
+
+# In-memory copy of the reporting tables, refreshed incrementally from new ids
+# and update_status audit events; restores, merges and shrinking tables force a rebuild
+class AnalyticsSnapshot:
+    def __init__(self, db_path='hospital.db', refresh_interval=ANALYTICS_REFRESH_INTERVAL,
+                 full_refresh_interval=ANALYTICS_FULL_REFRESH_INTERVAL):
+        self.db_path = os.path.abspath(db_path)
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.lock = threading.Lock()          # guards self.conn for readers
+        self.refresh_lock = threading.Lock()  # one refresh at a time
+        self.conn = None
+        self.last_ids = {}
+        self.last_audit_id = 0
+        self.refreshed_at = None
+        self.rebuilt_at = None
+        self.full_refresh()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="analytics-refresh", daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(':memory:', uri=True, check_same_thread=False, isolation_level=None)
+        conn.execute("ATTACH DATABASE ? AS src", (f"file:{self.db_path}?mode=ro",))
+        return conn
+
+    def _watermarks(self, conn):
+        last_ids = {}
+        for table in ANALYTICS_TABLES:
+            last_ids[table] = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM main.{table}").fetchone()[0]
+        return last_ids
+
+    def full_refresh(self):
+        with self.refresh_lock:
+            # Build the new copy on the side so readers keep using the old one
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN")
+                for table in ANALYTICS_TABLES:
+                    create_sql = conn.execute(
+                        "SELECT sql FROM src.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+                    ).fetchone()[0]
+                    conn.execute(create_sql)
+                    conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+                last_audit_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM src.audit_log").fetchone()[0]
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.close()
+                raise
+
+            with self.lock:
+                old_conn, self.conn = self.conn, conn
+                self.last_ids = self._watermarks(conn)
+                self.last_audit_id = last_audit_id
+                self.refreshed_at = self.rebuilt_at = datetime.now()
+            if old_conn is not None:
+                old_conn.close()
+
+    def refresh(self):
+        if (datetime.now() - self.rebuilt_at).total_seconds() >= self.full_refresh_interval:
+            return self.full_refresh()
+
+        with self.refresh_lock:
+            with self.lock:
+                conn = self.conn
+                conn.execute("BEGIN")
+                try:
+                    events = conn.execute('''
+                        SELECT id, action, entity, entity_id FROM src.audit_log
+                        WHERE id > ? AND action IN ('update_status', 'restore', 'merge')
+                        ORDER BY id
+                    ''', (self.last_audit_id,)).fetchall()
+                    last_audit_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM src.audit_log").fetchone()[0]
+                    shrunk = last_audit_id < self.last_audit_id or any(
+                        conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM src.{table}").fetchone()[0] < last_id
+                        for table, last_id in self.last_ids.items()
+                    )
+                    needs_rebuild = shrunk or any(action in ('restore', 'merge') for _, action, _, _ in events)
+
+                    if not needs_rebuild:
+                        for table, last_id in self.last_ids.items():
+                            conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table} WHERE id > ?",
+                                         (last_id,))
+                        for _, _, entity, entity_id in events:
+                            table = ANALYTICS_UPDATED_ENTITIES.get(entity)
+                            if table:
+                                conn.execute(f"INSERT OR REPLACE INTO main.{table} SELECT * FROM src.{table} WHERE id = ?",
+                                             (entity_id,))
+                    conn.execute("COMMIT")
+                except sqlite3.Error:
+                    conn.execute("ROLLBACK")
+                    raise
+
+                if not needs_rebuild:
+                    self.last_ids = self._watermarks(conn)
+                    self.last_audit_id = last_audit_id
+                    self.refreshed_at = datetime.now()
+
+        if needs_rebuild:
+            self.full_refresh()
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+    def staleness(self):
+        return (datetime.now() - self.refreshed_at).total_seconds()
+
+    def _run(self):
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                pass  # keep serving the current copy, retry next interval
+
+# One snapshot per server process, shared by every session
+@st.cache_resource
+def get_analytics_snapshot():
+    return AnalyticsSnapshot()
+
+def analytics_staleness_caption():
+    snapshot = get_analytics_snapshot()
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.caption(f"Analytics snapshot as of {snapshot.refreshed_at.strftime('%H:%M:%S')} "
+                   f"({snapshot.staleness():.0f}s old, refreshes every {snapshot.refresh_interval}s)")
+    with col2:
+        if st.button("Refresh Analytics"):
+            snapshot.refresh()
+            st.rerun()
+
+# Appointment reminders
+REMINDER_LEAD_HOURS = 24        # remind patients this long before the appointment
+REMINDER_LOOKAHEAD_DAYS = 1     # load appointments this far beyond the lead window
+REMINDER_BATCH_WINDOW = 5       # seconds; reminders falling due close together are written together
+REMINDER_DELIVERY_BATCH = 500
+REMINDER_RESCAN_SECONDS = 60    # how often appointments booked outside this process are picked up
+REMINDER_OUTBOX_FILE = 'reminders_outbox.jsonl'
+
+def deliver_reminders_to_file(reminders, path=REMINDER_OUTBOX_FILE):
+    # Default delivery backend: append one JSON line per reminder.
+    # A backend receives a list of outbox rows (dicts) and returns the ids it delivered.
+    with open(path, 'a', encoding='utf-8') as f:
+        for reminder in reminders:
+            f.write(json.dumps(reminder) + "\n")
+    return [reminder['id'] for reminder in reminders]
+
+# Upcoming Scheduled appointments are kept in a heap ordered by reminder time
+# (cancelled entries are skipped when popped; self.pending is the source of truth).
+# A background thread writes due reminders to reminder_outbox and hands them to deliver.
+# Bookings made outside this process are picked up by id within REMINDER_RESCAN_SECONDS;
+# an existing appointment set back to Scheduled outside the app is not.
+class ReminderScheduler:
+    def __init__(self, db_path='hospital.db', lead_hours=REMINDER_LEAD_HOURS, deliver=None):
+        self.db_path = os.path.abspath(db_path)
+        self.lead = timedelta(hours=lead_hours)
+        if deliver is None:
+            outbox_path = os.path.abspath(REMINDER_OUTBOX_FILE)
+            deliver = lambda reminders: deliver_reminders_to_file(reminders, outbox_path)
+        self.deliver = deliver
+        self.heap = []      # (remind_at, appointment_id)
+        self.pending = {}   # appointment_id -> remind_at
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.loaded_until = datetime.now().strftime('%Y-%m-%d')  # exclusive
+        self.seen_id = self._max_appointment_id()  # appointments up to here are loaded
+        self.sent_count = 0
+        self.last_error = None
+        self.last_error_at = None
+        self.load_upcoming()
+        self.thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self.thread.start()
+
+    def _horizon(self):
+        return (datetime.now() + self.lead + timedelta(days=REMINDER_LOOKAHEAD_DAYS)).strftime('%Y-%m-%d')
+
+    def _push(self, appointment_id, date, time_, now):
+        try:
+            appointment_at = datetime.strptime(f"{date} {time_}", '%Y-%m-%d %H:%M')
+        except ValueError:
+            return False
+        if appointment_at <= now:
+            return False
+        remind_at = appointment_at - self.lead
+        self.pending[appointment_id] = remind_at
+        heapq.heappush(self.heap, (remind_at, appointment_id))
+        return True
+
+    def _max_appointment_id(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM appointments").fetchone()[0]
+        finally:
+            conn.close()
+
+    def load_new(self):
+        # Appointments added to the loaded window since the last scan by anything
+        # other than schedule(): another server process, direct SQL, imports.
+        # The id range keeps this to the new rows only.
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM appointments").fetchone()[0]
+            rows = conn.execute('''
+                SELECT id, date, time FROM appointments
+                WHERE id > ? AND id <= ? AND status = 'Scheduled' AND date >= ? AND date < ?
+            ''', (self.seen_id, last_id, datetime.now().strftime('%Y-%m-%d'), self.loaded_until)).fetchall()
+        finally:
+            conn.close()
+
+        now = datetime.now()
+        with self.lock:
+            loaded = sum(self._push(appointment_id, date, time_, now)
+                         for appointment_id, date, time_ in rows if appointment_id not in self.pending)
+            self.seen_id = max(self.seen_id, last_id)
+        return loaded
+
+    def load_upcoming(self):
+        horizon = self._horizon()
+        if horizon <= self.loaded_until:
+            return 0
+
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            rows = conn.execute('''
+                SELECT id, date, time FROM appointments
+                WHERE status = 'Scheduled' AND date >= ? AND date < ?
+            ''', (self.loaded_until, horizon)).fetchall()
+        finally:
+            conn.close()
+
+        now = datetime.now()
+        with self.lock:
+            loaded = sum(self._push(appointment_id, date, time_, now) for appointment_id, date, time_ in rows)
+            self.loaded_until = horizon
+        return loaded
+
+    def reload(self):
+        # Used after the database is replaced wholesale (restore). Reminders whose
+        # time has passed are pushed again, but restore_database keeps the live
+        # reminder_outbox, so UNIQUE (appointment_id, remind_at) drops the repeats
+        with self.lock:
+            self.heap = []
+            self.pending = {}
+            self.loaded_until = datetime.now().strftime('%Y-%m-%d')
+        self.seen_id = self._max_appointment_id()
+        self.load_upcoming()
+        self.wakeup.set()
+
+    def schedule(self, appointment_id, date, time_):
+        # Appointments beyond the horizon are picked up by load_upcoming later
+        if date >= self._horizon():
+            return
+        with self.lock:
+            earliest = self.heap[0][0] if self.heap else None
+            if self._push(appointment_id, date, time_, datetime.now()):
+                if earliest is None or self.pending[appointment_id] < earliest:
+                    self.wakeup.set()
+
+    def cancel(self, appointment_id):
+        with self.lock:
+            self.pending.pop(appointment_id, None)
+
+    def queued(self):
+        with self.lock:
+            return len(self.pending)
+
+    def next_due(self):
+        with self.lock:
+            # Drop cancelled entries from the top so the peek is accurate
+            while self.heap and self.pending.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+    def _pop_due(self, now):
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                remind_at, appointment_id = heapq.heappop(self.heap)
+                if self.pending.get(appointment_id) == remind_at:
+                    del self.pending[appointment_id]
+                    due.append((appointment_id, remind_at))
+        return due
+
+    def _write_outbox(self, due):
+        # Status is re-checked here in case the appointment was cancelled
+        # from another process; UNIQUE (appointment_id, remind_at) drops repeats
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT OR IGNORE INTO reminder_outbox (appointment_id, remind_at, patient_name, phone, email, message)
+                    SELECT a.id, ?, p.name, p.phone, p.email,
+                           'Reminder: appointment with Dr. ' || COALESCE(d.name, '') || ' on ' || a.date || ' at ' || a.time
+                    FROM appointments a
+                    LEFT JOIN patients p ON p.id = a.patient_id
+                    LEFT JOIN doctors d ON d.id = a.doctor_id
+                    WHERE a.id = ? AND a.status = 'Scheduled'
+                ''', [(remind_at.strftime('%Y-%m-%d %H:%M'), appointment_id) for appointment_id, remind_at in due])
+        except sqlite3.Error:
+            with self.lock:
+                for appointment_id, remind_at in due:
+                    self.pending.setdefault(appointment_id, remind_at)
+                    heapq.heappush(self.heap, (remind_at, appointment_id))
+            raise
+        finally:
+            conn.close()
+
+    def deliver_pending(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute('''
+                SELECT id, appointment_id, remind_at, patient_name, phone, email, message
+                FROM reminder_outbox WHERE status = 'Pending' ORDER BY id LIMIT ?
+            ''', (REMINDER_DELIVERY_BATCH,)).fetchall()
+            if not rows:
+                return 0
+
+            delivered = self.deliver([dict(row) for row in rows])
+            sent_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            with conn:
+                conn.executemany("UPDATE reminder_outbox SET status = 'Sent', sent_date = ? WHERE id = ?",
+                                 [(sent_date, reminder_id) for reminder_id in delivered])
+        finally:
+            conn.close()
+        self.sent_count += len(delivered)
+        return len(delivered)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.load_new()
+                self.load_upcoming()
+                due = self._pop_due(datetime.now())
+                if due:
+                    self._write_outbox(due)
+                # Stop as soon as a batch is not fully delivered, so undelivered rows are retried next wake-up
+                while self.deliver_pending() == REMINDER_DELIVERY_BATCH:
+                    pass
+                self.last_error = None
+            except Exception as e:
+                # Delivery backends are pluggable, so any failure is recorded for the Reminders tab
+                # and retried on the next wake-up instead of stopping the thread
+                self.last_error = f"{type(e).__name__}: {e}"
+                self.last_error_at = datetime.now()
+
+            next_due = self.next_due()
+            timeout = (next_due - datetime.now()).total_seconds() if next_due else REMINDER_RESCAN_SECONDS
+            # Wake regularly to pick up outside bookings and extend the loaded window
+            self.wakeup.wait(min(max(timeout, REMINDER_BATCH_WINDOW), REMINDER_RESCAN_SECONDS))
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+# One scheduler per server process
+@st.cache_resource
+def get_reminder_scheduler():
+    return ReminderScheduler()
+
+get_reminder_scheduler()
+
+# Interaction timing
+def record_timing(scope, seconds):
+    timings = st.session_state.setdefault('interaction_timings', {})
+    samples = timings.setdefault(scope, [])
+    samples.append(seconds)
+    del samples[:-50]
+
+def timed_fragment(func):
+    # A fragment reruns on its own when its widgets change, without
+    # re-executing the page config, init_db, load_data or the rest of the page
+    @st.fragment
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record_timing(func.__name__, time.perf_counter() - started)
+    return wrapper
+
+def rerun_fragment():
+    # scope="fragment" is only allowed during a fragment rerun. A fragment's
+    # buttons also run as part of full-app runs (e.g. under AppTest), which need a full rerun.
+    ctx = get_script_run_ctx()
+    st.rerun(scope="fragment" if ctx and ctx.fragment_ids_this_run else "app")
+
+def interaction_timings_panel():
+    timings = st.session_state.get('interaction_timings', {})
+    with st.expander("⏱️ Interaction Latency"):
+        if timings:
+            st.dataframe(pd.DataFrame([{
+                'Scope': scope,
+                'Runs': len(samples),
+                'Last (ms)': round(samples[-1] * 1000, 1),
+                'Median (ms)': round(sorted(samples)[len(samples) // 2] * 1000, 1)
+            } for scope, samples in timings.items()]), use_container_width=True, hide_index=True)
+        else:
+            st.caption("No interactions timed yet.")
+
+# Cached record tables
+def appointment_table():
+    # Built once per data load; status updates patch their row in place
+    key = (st.session_state.data_version, len(st.session_state.appointments))
+    cached = st.session_state.get('appointment_table')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    
+    patient_names = {p['id']: p['name'] for p in st.session_state.patients}
+    doctor_names = {d['id']: d['name'] for d in st.session_state.doctors}
+    appt_df = pd.DataFrame([{
+        'ID': appt['id'],
+        'Patient': patient_names.get(appt['patient_id'], 'Unknown'),
+        'Doctor': doctor_names.get(appt['doctor_id'], 'Unknown'),
+        'Date': appt['date'],
+        'Time': appt['time'],
+        'Reason': appt['reason'],
+        'Status': appt['status']
+    } for appt in st.session_state.appointments])
+    st.session_state.appointment_table = (key, appt_df)
+    return appt_df
+
+def bill_table():
+    # Built once per data load; status updates patch their row in place
+    key = (st.session_state.data_version, len(st.session_state.bills))
+    cached = st.session_state.get('bill_table')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    
+    patient_names = {p['id']: p['name'] for p in st.session_state.patients}
+    bill_df = pd.DataFrame([{
+        'ID': bill['id'],
+        'Patient': patient_names.get(bill['patient_id'], 'Unknown'),
+        'Doctor Fee': f"${bill['doctor_fee']:,.2f}",
+        'Medicine Fee': f"${bill['medicine_fee']:,.2f}",
+        'Room Charge': f"${bill['room_charge']:,.2f}",
+        'Other Charges': f"${bill['other_charges']:,.2f}",
+        'Total Amount': f"${bill['total_amount']:,.2f}",
+        'Date': bill['date'],
+        'Status': bill['status']
+    } for bill in st.session_state.bills])
+    st.session_state.bill_table = (key, bill_df)
+    return bill_df
+
 # Utility functions
 def generate_patient_id():
     return f"P{random.randint(10000, 99999)}"
@@ -211,6 +892,287 @@ def validate_phone(phone):
     pattern = r'^\+?[0-9]{10,15}$'
     return re.match(pattern, phone) is not None
 
+# Duplicate patient detection
+DUPLICATE_THRESHOLD = 0.7        # minimum score reported as a possible duplicate
+DUPLICATE_MINHASH_SEEDS = [0x9E3779B1, 0x85EBCA77]  # one trigram MinHash name key per seed
+DUPLICATE_BLOCK_LIMIT = 100      # candidates read per name key in the real-time check
+DUPLICATE_WINDOW = 20            # neighbours compared per patient in large blocks
+DUPLICATE_AGE_GAP = 5            # ages further apart than this mean a different person
+SOUNDEX_CODES = {c: d for d, letters in {'1': 'bfpv', '2': 'cgjkqsxz', '3': 'dt',
+                                         '4': 'l', '5': 'mn', '6': 'r'}.items() for c in letters}
+
+def normalize_name(name):
+    # Lowercase letters only, tokens sorted so "Smith John" matches "John Smith"
+    return ' '.join(sorted(re.findall(r'[a-z]+', (name or '').lower())))
+
+def normalize_phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-10:] if len(digits) >= 7 else ''
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+def soundex(word):
+    code = word[0].upper()
+    last = SOUNDEX_CODES.get(word[0], '')
+    for c in word[1:]:
+        digit = SOUNDEX_CODES.get(c, '')
+        if digit and digit != last:
+            code += digit
+        if c not in 'hw':
+            last = digit
+    return (code + '000')[:4]
+
+def patient_block_keys(name, phone, email):
+    # Two patients can only be compared if they share at least one key
+    keys = set()
+    phone = normalize_phone(phone)
+    if phone:
+        keys.add(f"phone:{phone}")
+    email = normalize_email(email)
+    if email:
+        keys.add(f"email:{email}")
+    name = normalize_name(name)
+    if name:
+        keys.add("sdx:" + ' '.join(sorted(soundex(token) for token in name.split())))
+        # MinHash over character trigrams: names sharing most trigrams (typos,
+        # a changed first letter) usually share a key even when Soundex differs
+        text = name.replace(' ', '').encode()
+        trigrams = [text[i:i + 3] for i in range(max(len(text) - 2, 1))]
+        for n, seed in enumerate(DUPLICATE_MINHASH_SEEDS):
+            keys.add(f"mh{n}:{min(zlib.crc32(trigram, seed) for trigram in trigrams)}")
+    return keys
+
+def name_matcher(patient):
+    # Callers scoring one patient against many build this once, so difflib
+    # analyses that patient's name, and each of its tokens, once instead of on
+    # every comparison
+    name = patient[0]
+    return (SequenceMatcher(None, b=name.replace(' ', '')),
+            [(len(token), SequenceMatcher(None, b=token)) for token in name.split()])
+
+def token_similarity(token_matchers, name):
+    # Tokens are paired greedily by best match, so a changed first letter that
+    # reorders the sorted tokens ("catherine johnson" / "johnson katherine") still
+    # compares Catherine with Katherine. Unpaired tokens count as mismatches.
+    tokens = name.split()
+    pairs = []
+    for j, token in enumerate(tokens):
+        for i, (_, matcher) in enumerate(token_matchers):
+            matcher.set_seq1(token)
+            pairs.append((matcher.ratio(), i, j))
+    pairs.sort(reverse=True)
+    used_a, used_b, matched = set(), set(), 0.0
+    for ratio, i, j in pairs:
+        if i not in used_a and j not in used_b:
+            used_a.add(i)
+            used_b.add(j)
+            matched += ratio * (token_matchers[i][0] + len(tokens[j]))
+    total = sum(length for length, _ in token_matchers) + sum(map(len, tokens))
+    return matched / total if total else 0.0
+
+def duplicate_score(a, b, matcher=None):
+    # a and b are (name, phone, email, age, gender) tuples, already normalized;
+    # matcher is name_matcher(a). A name alone (0.65) is not enough; a close name
+    # (similarity >= 0.77) with the same age and gender is, as is a fairly close
+    # name with the same phone. A clearly different age or gender costs 0.3, so a
+    # shared family phone or email does not make relatives duplicates.
+    bonus = 0.0
+    if a[1] and a[1] == b[1]:
+        bonus += 0.3
+    if a[2] and a[2] == b[2]:
+        bonus += 0.2
+    if a[3] and b[3] and abs(a[3] - b[3]) <= 1 and a[4] == b[4]:
+        bonus += 0.2
+    elif (a[3] and b[3] and abs(a[3] - b[3]) > DUPLICATE_AGE_GAP) or (a[4] and b[4] and a[4] != b[4]):
+        bonus -= 0.3
+
+    # Skip the full comparison when even identical names could not reach the threshold
+    needed = (DUPLICATE_THRESHOLD - bonus) / 0.65
+    if needed > 1:
+        return 0.0
+    if a[0] == b[0]:
+        similarity = 1.0
+    else:
+        # The quick ratios of the names without spaces bound both measures below
+        name_a, token_matchers = matcher or name_matcher(a)
+        name_a.set_seq1(b[0].replace(' ', ''))
+        if name_a.real_quick_ratio() < needed or name_a.quick_ratio() < needed:
+            return 0.0
+        similarity = max(name_a.ratio(), token_similarity(token_matchers, b[0]))
+    return min(0.65 * similarity + bonus, 1.0)
+
+def normalized_patient(name, phone, email, age, gender):
+    return (normalize_name(name), normalize_phone(phone), normalize_email(email), age or 0, gender or '')
+
+def block_key_rows(patient_id, name, phone, email, age, gender):
+    # Gender, age and normalized name are stored with each key so a name key can be
+    # narrowed to the patients who could actually score as duplicates
+    return [(key, gender or '', age or 0, normalize_name(name), patient_id)
+            for key in patient_block_keys(name, phone, email)]
+
+def index_patient_block_keys(conn):
+    # Incremental: only patients above the highest id already indexed
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(patient_id), 0) FROM patient_block_keys")
+    last_id = cursor.fetchone()[0]
+    cursor.execute("SELECT id, name, phone, email, age, gender FROM patients WHERE id > ? ORDER BY id", (last_id,))
+
+    indexed = 0
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        # Sorted so the inserts walk the key index in order
+        conn.executemany(
+            "INSERT OR IGNORE INTO patient_block_keys (block_key, gender, age, name, patient_id) VALUES (?, ?, ?, ?, ?)",
+            sorted(key_row for row in rows for key_row in block_key_rows(*row))
+        )
+        indexed += len(rows)
+    conn.commit()
+    return indexed
+
+# Existing patients resembling the given details, as [(score, patient)] best first
+def find_possible_duplicates(name, phone, email, age, gender, exclude_id=None):
+    conn = sqlite3.connect('hospital.db')
+    conn.row_factory = sqlite3.Row
+    index_patient_block_keys(conn)
+
+    candidate_ids = set()
+    for key in patient_block_keys(name, phone, email):
+        if key.startswith(('phone:', 'email:')):
+            rows = conn.execute("SELECT patient_id FROM patient_block_keys WHERE block_key = ?", (key,))
+        elif age and gender:
+            # Without a phone or email match only a close name with the same gender
+            # and age (+/- 1) can reach the threshold, so name keys are read for
+            # those patients alone, exact names and ages first
+            rows = conn.execute('''
+                SELECT patient_id FROM patient_block_keys
+                WHERE block_key = ? AND gender = ? AND age BETWEEN ? AND ?
+                ORDER BY name = ? DESC, age = ? DESC LIMIT ?
+            ''', (key, gender, age - 1, age + 1, normalize_name(name), age, DUPLICATE_BLOCK_LIMIT))
+        else:
+            continue
+        candidate_ids.update(row[0] for row in rows)
+    candidate_ids.discard(exclude_id)
+
+    scores = {}
+    if candidate_ids:
+        new_patient = normalized_patient(name, phone, email, age, gender)
+        matcher = name_matcher(new_patient)
+        placeholders = ','.join('?' * len(candidate_ids))
+        for row in conn.execute(f"SELECT id, name, phone, email, age, gender FROM patients WHERE id IN ({placeholders})",
+                                list(candidate_ids)):
+            score = duplicate_score(new_patient, normalized_patient(*row[1:]), matcher)
+            if score >= DUPLICATE_THRESHOLD:
+                scores[row[0]] = score
+
+    matches = []
+    if scores:
+        placeholders = ','.join('?' * len(scores))
+        for row in conn.execute(f"SELECT * FROM patients WHERE id IN ({placeholders})", list(scores)):
+            matches.append((scores[row['id']], dict(row)))
+    conn.close()
+    return sorted(matches, key=lambda match: -match[0])
+
+# Groups likely duplicates into clusters. Patients are streamed one block at a
+# time; within a block each is compared with the next DUPLICATE_WINDOW members
+# sorted by gender, name and age, and matches are joined with union-find.
+def find_duplicate_clusters():
+    conn = sqlite3.connect('hospital.db')
+    index_patient_block_keys(conn)
+
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+
+    rows = conn.execute('''
+        SELECT k.block_key, p.id, p.name, p.phone, p.email, p.age, p.gender
+        FROM patient_block_keys k JOIN patients p ON p.id = k.patient_id
+        ORDER BY k.block_key
+    ''')
+    pairs = 0
+    for _, block in itertools.groupby(rows, key=lambda row: row[0]):
+        members = [(row[1], normalized_patient(*row[2:])) for row in block]
+        if len(members) < 2:
+            continue
+        members.sort(key=lambda member: (member[1][4], member[1][0], member[1][3]))
+        for i, (id_a, patient_a) in enumerate(members):
+            matcher = name_matcher(patient_a)
+            for id_b, patient_b in members[i + 1:i + 1 + DUPLICATE_WINDOW]:
+                if find(id_a) == find(id_b):
+                    continue
+                if duplicate_score(patient_a, patient_b, matcher) >= DUPLICATE_THRESHOLD:
+                    root_b = find(id_b)
+                    parent.setdefault(root_b, root_b)
+                    parent[find(id_a)] = root_b
+                    pairs += 1
+
+    clusters = {}
+    for patient_id in parent:
+        clusters.setdefault(find(patient_id), []).append(patient_id)
+    conn.close()
+    return sorted(clusters.values(), key=len, reverse=True), pairs
+
+# Folds merge_id into keep_id in one transaction. The audit event keeps the merged
+# record, the moved appointment and bill ids and the filled fields, so it can be reversed by hand.
+def merge_patients(keep_id, merge_id):
+    if keep_id == merge_id:
+        raise ValueError("Cannot merge a patient into itself")
+
+    conn = sqlite3.connect('hospital.db')
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            keep = conn.execute("SELECT * FROM patients WHERE id = ?", (keep_id,)).fetchone()
+            merged = conn.execute("SELECT * FROM patients WHERE id = ?", (merge_id,)).fetchone()
+            if keep is None or merged is None:
+                raise ValueError("Both patients must exist")
+
+            appointment_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM appointments WHERE patient_id = ? ORDER BY id", (merge_id,))]
+            bill_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM bills WHERE patient_id = ? ORDER BY id", (merge_id,))]
+            conn.execute("UPDATE appointments SET patient_id = ? WHERE patient_id = ?", (keep_id, merge_id))
+            conn.execute("UPDATE bills SET patient_id = ? WHERE patient_id = ?", (keep_id, merge_id))
+
+            filled_fields = []
+            for field in ['age', 'gender', 'address', 'phone', 'email', 'blood_group', 'medical_history']:
+                if not keep[field] and merged[field]:
+                    conn.execute(f"UPDATE patients SET {field} = ? WHERE id = ?", (merged[field], keep_id))
+                    filled_fields.append(field)
+
+            conn.execute("DELETE FROM patient_block_keys WHERE patient_id IN (?, ?)", (keep_id, merge_id))
+            conn.execute("DELETE FROM patients WHERE id = ?", (merge_id,))
+
+            kept = conn.execute("SELECT id, name, phone, email, age, gender FROM patients WHERE id = ?",
+                                (keep_id,)).fetchone()
+            conn.executemany(
+                "INSERT OR IGNORE INTO patient_block_keys (block_key, gender, age, name, patient_id) VALUES (?, ?, ?, ?, ?)",
+                block_key_rows(*kept)
+            )
+    finally:
+        conn.close()
+
+    audit('merge', 'patient', merge_id, before=dict(merged),
+          after={'merged_into': keep_id, 'appointment_ids': appointment_ids, 'bill_ids': bill_ids,
+                 'filled_fields': filled_fields})
+    return len(appointment_ids), len(bill_ids)
+
+# Index patients added since the last start (once per server process)
+@st.cache_resource
+def backfill_patient_block_keys():
+    conn = sqlite3.connect('hospital.db')
+    indexed = index_patient_block_keys(conn)
+    conn.close()
+    return indexed
+
+backfill_patient_block_keys()
+
 # Login page
 def login_page():
     st.title("🏥 Hospital Management System")
@@ -300,14 +1262,16 @@ def dashboard_page():
     else:
         st.info("No appointments scheduled yet.")
     
-    # Charts
+    # Charts (served from the analytics snapshot)
+    snapshot = get_analytics_snapshot()
+    analytics_staleness_caption()
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("📊 Patients by Gender")
-        if st.session_state.patients:
-            gender_counts = pd.DataFrame(st.session_state.patients)['gender'].value_counts()
-            fig = px.pie(values=gender_counts.values, names=gender_counts.index, 
+        gender_counts = snapshot.query("SELECT gender, COUNT(*) AS count FROM patients GROUP BY gender")
+        if not gender_counts.empty:
+            fig = px.pie(gender_counts, values='count', names='gender', 
                          title="Patient Gender Distribution")
             st.plotly_chart(fig, use_container_width=True)
         else:
@@ -315,77 +1279,221 @@ def dashboard_page():
     
     with col2:
         st.subheader("📈 Revenue Trend (Last 7 Days)")
-        if st.session_state.bills:
-            bill_df = pd.DataFrame(st.session_state.bills)
-            bill_df['date'] = pd.to_datetime(bill_df['date'])
-            last_week = datetime.now() - timedelta(days=7)
-            recent_bills = bill_df[bill_df['date'] >= last_week]
-            
-            if not recent_bills.empty:
-                revenue_trend = recent_bills.groupby('date')['total_amount'].sum().reset_index()
-                fig = px.line(revenue_trend, x='date', y='total_amount', 
-                             title="Daily Revenue Trend", labels={'total_amount': 'Revenue ($)'})
-                st.plotly_chart(fig, use_container_width=True)
+        last_week = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        revenue_trend = snapshot.query(
+            "SELECT date, SUM(total_amount) AS total_amount FROM bills WHERE date >= ? GROUP BY date ORDER BY date",
+            (last_week,)
+        )
+        if not revenue_trend.empty:
+            revenue_trend['date'] = pd.to_datetime(revenue_trend['date'])
+            fig = px.line(revenue_trend, x='date', y='total_amount', 
+                         title="Daily Revenue Trend", labels={'total_amount': 'Revenue ($)'})
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No revenue data for the last 7 days.")
+
+# Patient form fragment
+@timed_fragment
+def add_patient_form():
+    # Details held back by the duplicate check are shown again for confirmation
+    pending = st.session_state.get('pending_patient')
+    warning_area = st.container()
+    
+    values = pending['values'] if pending else {}
+    genders = ["", "Male", "Female", "Other"]
+    blood_groups = ["", "A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+    
+    with st.form("patient_form", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            name = st.text_input("Full Name*", value=values.get('name', ''))
+            age = st.number_input("Age*", min_value=0, max_value=120, value=values.get('age', 0))
+            gender = st.selectbox("Gender*", genders, index=genders.index(values.get('gender', '')))
+            phone = st.text_input("Phone Number*", value=values.get('phone', ''))
+        
+        with col2:
+            email = st.text_input("Email", value=values.get('email', ''))
+            blood_group = st.selectbox("Blood Group", blood_groups,
+                                       index=blood_groups.index(values.get('blood_group', '')))
+            address = st.text_area("Address", value=values.get('address', ''))
+        
+        medical_history = st.text_area("Medical History", value=values.get('medical_history', ''))
+        
+        confirmed = st.checkbox("Not a duplicate, register anyway") if pending else False
+        
+        submitted = st.form_submit_button("Add Patient")
+        
+        if submitted:
+            if not name or not age or not gender or not phone:
+                st.error("Please fill in all required fields (*)")
+            elif email and not validate_email(email):
+                st.error("Please enter a valid email address")
+            elif not validate_phone(phone):
+                st.error("Please enter a valid phone number")
             else:
-                st.info("No revenue data for the last 7 days.")
+                matches = [] if confirmed else find_possible_duplicates(name, phone, email, age, gender)
+                
+                if matches:
+                    st.session_state.pending_patient = {
+                        'values': {
+                            'name': name, 'age': age, 'gender': gender, 'phone': phone, 'email': email,
+                            'blood_group': blood_group, 'address': address, 'medical_history': medical_history
+                        },
+                        'matches': matches
+                    }
+                    rerun_fragment()
+                
+                conn = sqlite3.connect('hospital.db')
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO patients (name, age, gender, address, phone, email, blood_group, medical_history)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (name, age, gender, address, phone, email, blood_group, medical_history))
+                
+                conn.commit()
+                patient_id = cursor.lastrowid
+                index_patient_block_keys(conn)
+                conn.close()
+                
+                # Update session state
+                patient = {
+                    'id': patient_id, 'name': name, 'age': age, 'gender': gender,
+                    'address': address, 'phone': phone, 'email': email,
+                    'blood_group': blood_group, 'medical_history': medical_history
+                }
+                st.session_state.patients.append(patient)
+                st.session_state.pop('pending_patient', None)
+                audit('create', 'patient', patient_id, after=patient)
+                
+                st.success(f"Patient added successfully with ID: {patient_id}")
+    
+    # Filled in last so the warning disappears as soon as the patient is registered
+    pending = st.session_state.get('pending_patient')
+    if pending:
+        with warning_area:
+            st.warning(f"{len(pending['matches'])} existing patient(s) look like the one you are adding. "
+                       "Check them before registering a new record.")
+            st.dataframe(pd.DataFrame([
+                {'Match': f"{score:.0%}", 'ID': p['id'], 'Name': p['name'], 'Age': p['age'],
+                 'Gender': p['gender'], 'Phone': p['phone'], 'Email': p['email']}
+                for score, p in pending['matches']
+            ]), use_container_width=True, hide_index=True)
+            
+            if st.button("Discard New Patient"):
+                del st.session_state.pending_patient
+                rerun_fragment()
+
+# Patient search fragment
+@timed_fragment
+def search_patients_fragment():
+    search_option = st.radio("Search by", ["Name", "Phone", "ID"])
+    search_query = st.text_input("Search term")
+    
+    if search_query:
+        if search_option == "Name":
+            results = [p for p in st.session_state.patients if search_query.lower() in p['name'].lower()]
+        elif search_option == "Phone":
+            results = [p for p in st.session_state.patients if search_query in p['phone']]
+        else:  # ID
+            results = [p for p in st.session_state.patients if search_query == str(p['id'])]
+        
+        if results:
+            st.dataframe(pd.DataFrame(results), use_container_width=True, hide_index=True)
+        else:
+            st.warning("No patients found matching your search criteria.")
+
+# Duplicate patients fragment
+@timed_fragment
+def duplicate_patients_fragment():
+    if st.button("Find Duplicate Patients"):
+        started = time.perf_counter()
+        with st.spinner("Comparing patients within their blocks..."):
+            clusters, pairs = find_duplicate_clusters()
+        st.session_state.duplicate_clusters = {
+            'clusters': clusters, 'pairs': pairs, 'seconds': time.perf_counter() - started,
+            'run_at': datetime.now().strftime('%Y-%m-%d %H:%M')
+        }
+    
+    report = st.session_state.get('duplicate_clusters')
+    if report is None:
+        st.info("Run the duplicate check to group patients who are probably the same person.")
+        return
+    
+    clusters = [c for c in report['clusters'] if len(c) > 1]
+    st.caption(f"{len(clusters)} clusters from {report['pairs']} matching pairs, "
+               f"found in {report['seconds']:.1f} s at {report['run_at']}")
+    if not clusters:
+        st.success("No duplicate patients found.")
+        return
+    
+    # Only the largest clusters are listed; merging them first removes the most duplicates
+    shown = clusters[:100]
+    ids = sorted({patient_id for cluster in shown for patient_id in cluster})
+    conn = sqlite3.connect('hospital.db')
+    placeholders = ','.join('?' * len(ids))
+    patients_df = pd.read_sql_query(f'''
+        SELECT p.id AS ID, p.name AS Name, p.age AS Age, p.gender AS Gender, p.phone AS Phone, p.email AS Email,
+               (SELECT COUNT(*) FROM appointments a WHERE a.patient_id = p.id) AS Appointments,
+               (SELECT COUNT(*) FROM bills b WHERE b.patient_id = p.id) AS Bills
+        FROM patients p WHERE p.id IN ({placeholders})
+    ''', conn, params=ids).set_index('ID', drop=False)
+    conn.close()
+    
+    def cluster_label(index):
+        names = patients_df.loc[[i for i in shown[index] if i in patients_df.index], 'Name']
+        return f"Cluster {index + 1}: {', '.join(dict.fromkeys(names))} ({len(shown[index])} records)"
+    
+    selected = st.selectbox("Cluster", range(len(shown)), format_func=cluster_label)
+    cluster = [i for i in shown[selected] if i in patients_df.index]
+    st.dataframe(patients_df.loc[cluster], use_container_width=True, hide_index=True)
+    
+    if len(cluster) < 2:
+        st.info("This cluster has already been merged.")
+        return
+    
+    # Merge
+    st.subheader("Merge Patients")
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        keep_id = st.selectbox("Keep Patient", cluster,
+                               format_func=lambda i: f"{i} - {patients_df.at[i, 'Name']}")
+    
+    with col2:
+        merge_id = st.selectbox("Merge Into Kept Patient", [i for i in cluster if i != keep_id],
+                                format_func=lambda i: f"{i} - {patients_df.at[i, 'Name']}")
+    
+    confirmed = st.checkbox(f"Move all appointments and bills of patient {merge_id} to patient {keep_id} "
+                            f"and delete patient {merge_id}")
+    
+    if st.button("Merge Patients", disabled=not confirmed):
+        try:
+            appointments, bills = merge_patients(keep_id, merge_id)
+        except ValueError as e:
+            st.error(str(e))
         else:
-            st.info("No billing data available for chart.")
+            for c in report['clusters']:
+                if merge_id in c:
+                    c.remove(merge_id)
+            # Patients, appointments and bills all changed, so reload and rerun the whole page
+            load_data()
+            st.success(f"Merged patient {merge_id} into {keep_id}: "
+                       f"{appointments} appointments and {bills} bills moved.")
+            time.sleep(1)
+            st.rerun()
 
 # Patient management page
 def patient_management_page():
     st.title("👥 Patient Management")
     
-    tab1, tab2, tab3 = st.tabs(["Add Patient", "View Patients", "Search Patients"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Add Patient", "View Patients", "Search Patients", "Duplicates"])
     
     with tab1:
         st.subheader("Add New Patient")
         
-        with st.form("patient_form", clear_on_submit=True):
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                name = st.text_input("Full Name*")
-                age = st.number_input("Age*", min_value=0, max_value=120, value=0)
-                gender = st.selectbox("Gender*", ["", "Male", "Female", "Other"])
-                phone = st.text_input("Phone Number*")
-            
-            with col2:
-                email = st.text_input("Email")
-                blood_group = st.selectbox("Blood Group", ["", "A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"])
-                address = st.text_area("Address")
-            
-            medical_history = st.text_area("Medical History")
-            
-            submitted = st.form_submit_button("Add Patient")
-            
-            if submitted:
-                if not name or not age or not gender or not phone:
-                    st.error("Please fill in all required fields (*)")
-                elif email and not validate_email(email):
-                    st.error("Please enter a valid email address")
-                elif not validate_phone(phone):
-                    st.error("Please enter a valid phone number")
-                else:
-                    conn = sqlite3.connect('hospital.db')
-                    cursor = conn.cursor()
-                    
-                    cursor.execute('''
-                        INSERT INTO patients (name, age, gender, address, phone, email, blood_group, medical_history)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (name, age, gender, address, phone, email, blood_group, medical_history))
-                    
-                    conn.commit()
-                    patient_id = cursor.lastrowid
-                    conn.close()
-                    
-                    # Update session state
-                    st.session_state.patients.append({
-                        'id': patient_id, 'name': name, 'age': age, 'gender': gender,
-                        'address': address, 'phone': phone, 'email': email,
-                        'blood_group': blood_group, 'medical_history': medical_history
-                    })
-                    
-                    st.success(f"Patient added successfully with ID: {patient_id}")
+        add_patient_form()
     
     with tab2:
         st.subheader("Patient Records")
@@ -399,21 +1507,60 @@ def patient_management_page():
     with tab3:
         st.subheader("Search Patients")
         
-        search_option = st.radio("Search by", ["Name", "Phone", "ID"])
-        search_query = st.text_input("Search term")
+        search_patients_fragment()
+    
+    with tab4:
+        st.subheader("Duplicate Patients")
         
-        if search_query:
-            if search_option == "Name":
-                results = [p for p in st.session_state.patients if search_query.lower() in p['name'].lower()]
-            elif search_option == "Phone":
-                results = [p for p in st.session_state.patients if search_query in p['phone']]
-            else:  # ID
-                results = [p for p in st.session_state.patients if search_query == str(p['id'])]
-            
-            if results:
-                st.dataframe(pd.DataFrame(results), use_container_width=True, hide_index=True)
+        duplicate_patients_fragment()
+
+# Doctor form fragment
+@timed_fragment
+def add_doctor_form():
+    with st.form("doctor_form", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            name = st.text_input("Full Name*")
+            specialization = st.text_input("Specialization*")
+            phone = st.text_input("Phone Number*")
+        
+        with col2:
+            email = st.text_input("Email")
+            fee = st.number_input("Consultation Fee*", min_value=0.0, value=0.0, step=10.0)
+            schedule = st.text_input("Schedule (e.g., Mon-Fri 9AM-5PM)*")
+        
+        submitted = st.form_submit_button("Add Doctor")
+        
+        if submitted:
+            if not name or not specialization or not phone or not fee or not schedule:
+                st.error("Please fill in all required fields (*)")
+            elif email and not validate_email(email):
+                st.error("Please enter a valid email address")
+            elif not validate_phone(phone):
+                st.error("Please enter a valid phone number")
             else:
-                st.warning("No patients found matching your search criteria.")
+                conn = sqlite3.connect('hospital.db')
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO doctors (name, specialization, phone, email, fee, schedule)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (name, specialization, phone, email, fee, schedule))
+                
+                conn.commit()
+                doctor_id = cursor.lastrowid
+                conn.close()
+                
+                # Update session state
+                doctor = {
+                    'id': doctor_id, 'name': name, 'specialization': specialization,
+                    'phone': phone, 'email': email, 'fee': fee, 'schedule': schedule
+                }
+                st.session_state.doctors.append(doctor)
+                audit('create', 'doctor', doctor_id, after=doctor)
+                
+                st.success(f"Doctor added successfully with ID: {doctor_id}")
 
 # Doctor management page
 def doctor_management_page():
@@ -424,168 +1571,287 @@ def doctor_management_page():
     with tab1:
         st.subheader("Add New Doctor")
         
-        with st.form("doctor_form", clear_on_submit=True):
+        add_doctor_form()
+    
+    with tab2:
+        st.subheader("Doctor Records")
+        
+        if st.session_state.doctors:
+            doctor_df = pd.DataFrame(st.session_state.doctors)
+            st.dataframe(doctor_df, use_container_width=True, hide_index=True)
+        else:
+            st.info("No doctor records found.")
+
+# Appointment form fragment
+@timed_fragment
+def schedule_appointment_form():
+    if not st.session_state.patients or not st.session_state.doctors:
+        st.error("Please add patients and doctors first before scheduling appointments.")
+    else:
+        with st.form("appointment_form", clear_on_submit=True):
             col1, col2 = st.columns(2)
             
             with col1:
-                name = st.text_input("Full Name*")
-                specialization = st.text_input("Specialization*")
-                phone = st.text_input("Phone Number*")
+                patient_options = {p['id']: f"{p['name']} (ID: {p['id']})" for p in st.session_state.patients}
+                patient_id = st.selectbox("Select Patient*", options=list(patient_options.keys()), 
+                                         format_func=lambda x: patient_options[x])
+                
+                doctor_options = {d['id']: f"Dr. {d['name']} ({d['specialization']})" for d in st.session_state.doctors}
+                doctor_id = st.selectbox("Select Doctor*", options=list(doctor_options.keys()), 
+                                       format_func=lambda x: doctor_options[x])
             
             with col2:
-                email = st.text_input("Email")
-                fee = st.number_input("Consultation Fee*", min_value=0.0, value=0.0, step=10.0)
-                schedule = st.text_input("Schedule (e.g., Mon-Fri 9AM-5PM)*")
+                appointment_date = st.date_input("Appointment Date*", min_value=datetime.now().date())
+                appointment_time = st.time_input("Appointment Time*", value=datetime.now().time())
+            
+            reason = st.text_area("Reason for Appointment*")
             
-            submitted = st.form_submit_button("Add Doctor")
+            submitted = st.form_submit_button("Schedule Appointment")
             
             if submitted:
-                if not name or not specialization or not phone or not fee or not schedule:
-                    st.error("Please fill in all required fields (*)")
-                elif email and not validate_email(email):
-                    st.error("Please enter a valid email address")
-                elif not validate_phone(phone):
-                    st.error("Please enter a valid phone number")
+                if not reason:
+                    st.error("Please provide a reason for the appointment")
                 else:
                     conn = sqlite3.connect('hospital.db')
                     cursor = conn.cursor()
                     
                     cursor.execute('''
-                        INSERT INTO doctors (name, specialization, phone, email, fee, schedule)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (name, specialization, phone, email, fee, schedule))
+                        INSERT INTO appointments (patient_id, doctor_id, date, time, reason)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (patient_id, doctor_id, appointment_date.strftime('%Y-%m-%d'), 
+                          appointment_time.strftime('%H:%M'), reason))
                     
                     conn.commit()
-                    doctor_id = cursor.lastrowid
+                    appointment_id = cursor.lastrowid
                     conn.close()
                     
                     # Update session state
-                    st.session_state.doctors.append({
-                        'id': doctor_id, 'name': name, 'specialization': specialization,
-                        'phone': phone, 'email': email, 'fee': fee, 'schedule': schedule
-                    })
+                    appointment = {
+                        'id': appointment_id, 'patient_id': patient_id, 'doctor_id': doctor_id,
+                        'date': appointment_date.strftime('%Y-%m-%d'), 
+                        'time': appointment_time.strftime('%H:%M'),
+                        'reason': reason, 'status': 'Scheduled'
+                    }
+                    st.session_state.appointments.append(appointment)
+                    audit('create', 'appointment', appointment_id, after=appointment)
+                    get_reminder_scheduler().schedule(appointment_id, appointment['date'], appointment['time'])
                     
-                    st.success(f"Doctor added successfully with ID: {doctor_id}")
-    
-    with tab2:
-        st.subheader("Doctor Records")
+                    st.success(f"Appointment scheduled successfully with ID: {appointment_id}")
+
+# Appointment records fragment
+@timed_fragment
+def appointment_records_fragment():
+    if st.session_state.appointments:
+        appt_df = appointment_table()
         
-        if st.session_state.doctors:
-            doctor_df = pd.DataFrame(st.session_state.doctors)
-            st.dataframe(doctor_df, use_container_width=True, hide_index=True)
-        else:
-            st.info("No doctor records found.")
+        # Status KPIs
+        status_counts = appt_df['Status'].value_counts()
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            st.metric("Scheduled", int(status_counts.get('Scheduled', 0)))
+        
+        with col2:
+            st.metric("Completed", int(status_counts.get('Completed', 0)))
+        
+        with col3:
+            st.metric("Cancelled", int(status_counts.get('Cancelled', 0)))
+        
+        st.dataframe(appt_df, use_container_width=True, hide_index=True)
+        
+        # Status update options
+        st.subheader("Update Appointment Status")
+        appt_ids = [appt['id'] for appt in st.session_state.appointments]
+        selected_appt = st.selectbox("Select Appointment", options=appt_ids)
+        new_status = st.selectbox("New Status", ["Scheduled", "Completed", "Cancelled"])
+        
+        if st.button("Update Status"):
+            conn = sqlite3.connect('hospital.db')
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT status FROM appointments WHERE id = ?", (selected_appt,))
+            old_status = cursor.fetchone()[0]
+            cursor.execute(
+                "UPDATE appointments SET status = ? WHERE id = ?",
+                (new_status, selected_appt)
+            )
+            
+            conn.commit()
+            conn.close()
+            audit('update_status', 'appointment', selected_appt,
+                  before={'status': old_status}, after={'status': new_status})
+            
+            # Update session state and the one affected table row
+            for appt in st.session_state.appointments:
+                if appt['id'] == selected_appt:
+                    appt['status'] = new_status
+                    break
+            appt_df.loc[appt_df['ID'] == selected_appt, 'Status'] = new_status
+            
+            # Keep the reminder queue in step with the new status
+            if new_status == 'Scheduled':
+                get_reminder_scheduler().schedule(selected_appt, appt['date'], appt['time'])
+            else:
+                get_reminder_scheduler().cancel(selected_appt)
+            
+            st.success("Appointment status updated successfully!")
+            rerun_fragment()
+    else:
+        st.info("No appointment records found.")
 
 # Appointment management page
 def appointment_management_page():
     st.title("📅 Appointment Management")
     
-    tab1, tab2 = st.tabs(["Schedule Appointment", "View Appointments"])
+    tab1, tab2, tab3 = st.tabs(["Schedule Appointment", "View Appointments", "Reminders"])
     
     with tab1:
         st.subheader("Schedule New Appointment")
         
-        if not st.session_state.patients or not st.session_state.doctors:
-            st.error("Please add patients and doctors first before scheduling appointments.")
-        else:
-            with st.form("appointment_form", clear_on_submit=True):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    patient_options = {p['id']: f"{p['name']} (ID: {p['id']})" for p in st.session_state.patients}
-                    patient_id = st.selectbox("Select Patient*", options=list(patient_options.keys()), 
-                                             format_func=lambda x: patient_options[x])
-                    
-                    doctor_options = {d['id']: f"Dr. {d['name']} ({d['specialization']})" for d in st.session_state.doctors}
-                    doctor_id = st.selectbox("Select Doctor*", options=list(doctor_options.keys()), 
-                                           format_func=lambda x: doctor_options[x])
-                
-                with col2:
-                    appointment_date = st.date_input("Appointment Date*", min_value=datetime.now().date())
-                    appointment_time = st.time_input("Appointment Time*", value=datetime.now().time())
-                
-                reason = st.text_area("Reason for Appointment*")
-                
-                submitted = st.form_submit_button("Schedule Appointment")
-                
-                if submitted:
-                    if not reason:
-                        st.error("Please provide a reason for the appointment")
-                    else:
-                        conn = sqlite3.connect('hospital.db')
-                        cursor = conn.cursor()
-                        
-                        cursor.execute('''
-                            INSERT INTO appointments (patient_id, doctor_id, date, time, reason)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (patient_id, doctor_id, appointment_date.strftime('%Y-%m-%d'), 
-                              appointment_time.strftime('%H:%M'), reason))
-                        
-                        conn.commit()
-                        appointment_id = cursor.lastrowid
-                        conn.close()
-                        
-                        # Update session state
-                        st.session_state.appointments.append({
-                            'id': appointment_id, 'patient_id': patient_id, 'doctor_id': doctor_id,
-                            'date': appointment_date.strftime('%Y-%m-%d'), 
-                            'time': appointment_time.strftime('%H:%M'),
-                            'reason': reason, 'status': 'Scheduled'
-                        })
-                        
-                        st.success(f"Appointment scheduled successfully with ID: {appointment_id}")
+        schedule_appointment_form()
     
     with tab2:
         st.subheader("Appointment Records")
         
-        if st.session_state.appointments:
-            # Create enhanced appointment data with patient and doctor names
-            appt_data = []
-            for appt in st.session_state.appointments:
-                patient = next((p for p in st.session_state.patients if p['id'] == appt['patient_id']), {})
-                doctor = next((d for d in st.session_state.doctors if d['id'] == appt['doctor_id']), {})
+        appointment_records_fragment()
+
+    with tab3:
+        st.subheader("Appointment Reminders")
+
+        scheduler = get_reminder_scheduler()
+        next_due = scheduler.next_due()
+
+        if scheduler.last_error:
+            st.error(f"Last reminder run failed at {scheduler.last_error_at.strftime('%Y-%m-%d %H:%M:%S')}: "
+                     f"{scheduler.last_error}")
+
+        col1, col2, col3 = st.columns(3)
+
+        with col1:
+            st.metric("Queued Reminders", scheduler.queued())
+
+        with col2:
+            st.metric("Next Reminder", next_due.strftime('%Y-%m-%d %H:%M') if next_due else "None")
+
+        with col3:
+            st.metric("Sent Since Start", scheduler.sent_count)
+
+        conn = sqlite3.connect('hospital.db')
+        outbox_df = pd.read_sql_query(
+            "SELECT * FROM reminder_outbox ORDER BY id DESC LIMIT 50", conn
+        )
+        conn.close()
+
+        if not outbox_df.empty:
+            st.dataframe(outbox_df, use_container_width=True, hide_index=True)
+        else:
+            st.info("No reminders have been sent yet.")
+
+# Bill form fragment
+@timed_fragment
+def generate_bill_form():
+    if not st.session_state.patients:
+        st.error("Please add patients first before generating bills.")
+    else:
+        with st.form("bill_form", clear_on_submit=True):
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                patient_options = {p['id']: f"{p['name']} (ID: {p['id']})" for p in st.session_state.patients}
+                patient_id = st.selectbox("Select Patient*", options=list(patient_options.keys()), 
+                                         format_func=lambda x: patient_options[x])
                 
-                appt_data.append({
-                    'ID': appt['id'],
-                    'Patient': patient.get('name', 'Unknown'),
-                    'Doctor': doctor.get('name', 'Unknown'),
-                    'Date': appt['date'],
-                    'Time': appt['time'],
-                    'Reason': appt['reason'],
-                    'Status': appt['status']
-                })
+                doctor_fee = st.number_input("Doctor Fee ($)*", min_value=0.0, value=0.0, step=10.0)
+                medicine_fee = st.number_input("Medicine Fee ($)*", min_value=0.0, value=0.0, step=10.0)
             
-            appt_df = pd.DataFrame(appt_data)
-            st.dataframe(appt_df, use_container_width=True, hide_index=True)
+            with col2:
+                room_charge = st.number_input("Room Charge ($)*", min_value=0.0, value=0.0, step=10.0)
+                other_charges = st.number_input("Other Charges ($)*", min_value=0.0, value=0.0, step=10.0)
+                bill_date = st.date_input("Bill Date*", value=datetime.now().date())
             
-            # Status update options
-            st.subheader("Update Appointment Status")
-            appt_ids = [appt['id'] for appt in st.session_state.appointments]
-            selected_appt = st.selectbox("Select Appointment", options=appt_ids)
-            new_status = st.selectbox("New Status", ["Scheduled", "Completed", "Cancelled"])
+            submitted = st.form_submit_button("Generate Bill")
             
-            if st.button("Update Status"):
+            if submitted:
+                total_amount = doctor_fee + medicine_fee + room_charge + other_charges
+                
                 conn = sqlite3.connect('hospital.db')
                 cursor = conn.cursor()
                 
-                cursor.execute(
-                    "UPDATE appointments SET status = ? WHERE id = ?",
-                    (new_status, selected_appt)
-                )
+                cursor.execute('''
+                    INSERT INTO bills (patient_id, doctor_fee, medicine_fee, room_charge, other_charges, total_amount, date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (patient_id, doctor_fee, medicine_fee, room_charge, other_charges, total_amount, 
+                      bill_date.strftime('%Y-%m-%d')))
                 
                 conn.commit()
+                bill_id = cursor.lastrowid
                 conn.close()
                 
                 # Update session state
-                for appt in st.session_state.appointments:
-                    if appt['id'] == selected_appt:
-                        appt['status'] = new_status
-                        break
+                bill = {
+                    'id': bill_id, 'patient_id': patient_id, 'doctor_fee': doctor_fee,
+                    'medicine_fee': medicine_fee, 'room_charge': room_charge, 
+                    'other_charges': other_charges, 'total_amount': total_amount,
+                    'date': bill_date.strftime('%Y-%m-%d'), 'status': 'Pending'
+                }
+                st.session_state.bills.append(bill)
+                audit('create', 'bill', bill_id, after=bill)
                 
-                st.success("Appointment status updated successfully!")
-                st.rerun()
-        else:
-            st.info("No appointment records found.")
+                st.success(f"Bill generated successfully with ID: {bill_id}")
+                st.info(f"Total Amount: ${total_amount:,.2f}")
+
+# Bill records fragment
+@timed_fragment
+def bill_records_fragment():
+    if st.session_state.bills:
+        bill_df = bill_table()
+        
+        # Payment KPIs
+        collected = sum(b['total_amount'] for b in st.session_state.bills if b['status'] == 'Paid')
+        outstanding = sum(b['total_amount'] for b in st.session_state.bills if b['status'] != 'Paid')
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.metric("Collected", f"${collected:,.2f}")
+        
+        with col2:
+            st.metric("Outstanding", f"${outstanding:,.2f}")
+        
+        st.dataframe(bill_df, use_container_width=True, hide_index=True)
+        
+        # Payment status update options
+        st.subheader("Update Payment Status")
+        bill_ids = [bill['id'] for bill in st.session_state.bills]
+        selected_bill = st.selectbox("Select Bill", options=bill_ids)
+        new_status = st.selectbox("Payment Status", ["Pending", "Paid"])
+        
+        if st.button("Update Payment Status"):
+            conn = sqlite3.connect('hospital.db')
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT status FROM bills WHERE id = ?", (selected_bill,))
+            old_status = cursor.fetchone()[0]
+            cursor.execute(
+                "UPDATE bills SET status = ? WHERE id = ?",
+                (new_status, selected_bill)
+            )
+            
+            conn.commit()
+            conn.close()
+            audit('update_status', 'bill', selected_bill,
+                  before={'status': old_status}, after={'status': new_status})
+            
+            # Update session state and the one affected table row
+            for bill in st.session_state.bills:
+                if bill['id'] == selected_bill:
+                    bill['status'] = new_status
+                    break
+            bill_df.loc[bill_df['ID'] == selected_bill, 'Status'] = new_status
+            
+            st.success("Payment status updated successfully!")
+            rerun_fragment()
+    else:
+        st.info("No bill records found.")
 
 # Billing management page
 def billing_management_page():
@@ -596,125 +1862,35 @@ def billing_management_page():
     with tab1:
         st.subheader("Generate New Bill")
         
-        if not st.session_state.patients:
-            st.error("Please add patients first before generating bills.")
-        else:
-            with st.form("bill_form", clear_on_submit=True):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    patient_options = {p['id']: f"{p['name']} (ID: {p['id']})" for p in st.session_state.patients}
-                    patient_id = st.selectbox("Select Patient*", options=list(patient_options.keys()), 
-                                             format_func=lambda x: patient_options[x])
-                    
-                    doctor_fee = st.number_input("Doctor Fee ($)*", min_value=0.0, value=0.0, step=10.0)
-                    medicine_fee = st.number_input("Medicine Fee ($)*", min_value=0.0, value=0.0, step=10.0)
-                
-                with col2:
-                    room_charge = st.number_input("Room Charge ($)*", min_value=0.0, value=0.0, step=10.0)
-                    other_charges = st.number_input("Other Charges ($)*", min_value=0.0, value=0.0, step=10.0)
-                    bill_date = st.date_input("Bill Date*", value=datetime.now().date())
-                
-                submitted = st.form_submit_button("Generate Bill")
-                
-                if submitted:
-                    total_amount = doctor_fee + medicine_fee + room_charge + other_charges
-                    
-                    conn = sqlite3.connect('hospital.db')
-                    cursor = conn.cursor()
-                    
-                    cursor.execute('''
-                        INSERT INTO bills (patient_id, doctor_fee, medicine_fee, room_charge, other_charges, total_amount, date)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (patient_id, doctor_fee, medicine_fee, room_charge, other_charges, total_amount, 
-                          bill_date.strftime('%Y-%m-%d')))
-                    
-                    conn.commit()
-                    bill_id = cursor.lastrowid
-                    conn.close()
-                    
-                    # Update session state
-                    st.session_state.bills.append({
-                        'id': bill_id, 'patient_id': patient_id, 'doctor_fee': doctor_fee,
-                        'medicine_fee': medicine_fee, 'room_charge': room_charge, 
-                        'other_charges': other_charges, 'total_amount': total_amount,
-                        'date': bill_date.strftime('%Y-%m-%d'), 'status': 'Pending'
-                    })
-                    
-                    st.success(f"Bill generated successfully with ID: {bill_id}")
-                    st.info(f"Total Amount: ${total_amount:,.2f}")
+        generate_bill_form()
     
     with tab2:
         st.subheader("Bill Records")
         
-        if st.session_state.bills:
-            # Create enhanced bill data with patient names
-            bill_data = []
-            for bill in st.session_state.bills:
-                patient = next((p for p in st.session_state.patients if p['id'] == bill['patient_id']), {})
-                
-                bill_data.append({
-                    'ID': bill['id'],
-                    'Patient': patient.get('name', 'Unknown'),
-                    'Doctor Fee': f"${bill['doctor_fee']:,.2f}",
-                    'Medicine Fee': f"${bill['medicine_fee']:,.2f}",
-                    'Room Charge': f"${bill['room_charge']:,.2f}",
-                    'Other Charges': f"${bill['other_charges']:,.2f}",
-                    'Total Amount': f"${bill['total_amount']:,.2f}",
-                    'Date': bill['date'],
-                    'Status': bill['status']
-                })
-            
-            bill_df = pd.DataFrame(bill_data)
-            st.dataframe(bill_df, use_container_width=True, hide_index=True)
-            
-            # Payment status update options
-            st.subheader("Update Payment Status")
-            bill_ids = [bill['id'] for bill in st.session_state.bills]
-            selected_bill = st.selectbox("Select Bill", options=bill_ids)
-            new_status = st.selectbox("Payment Status", ["Pending", "Paid"])
-            
-            if st.button("Update Payment Status"):
-                conn = sqlite3.connect('hospital.db')
-                cursor = conn.cursor()
-                
-                cursor.execute(
-                    "UPDATE bills SET status = ? WHERE id = ?",
-                    (new_status, selected_bill)
-                )
-                
-                conn.commit()
-                conn.close()
-                
-                # Update session state
-                for bill in st.session_state.bills:
-                    if bill['id'] == selected_bill:
-                        bill['status'] = new_status
-                        break
-                
-                st.success("Payment status updated successfully!")
-                st.rerun()
-        else:
-            st.info("No bill records found.")
+        bill_records_fragment()
 
 # Reports and analytics page
 def reports_page():
     st.title("📊 Reports & Analytics")
     
+    # All report queries run against the analytics snapshot, not hospital.db
+    snapshot = get_analytics_snapshot()
+    analytics_staleness_caption()
+    
     tab1, tab2, tab3 = st.tabs(["Patient Analytics", "Financial Reports", "Appointment Reports"])
     
     with tab1:
         st.subheader("Patient Analytics")
         
-        if st.session_state.patients:
+        age_data = snapshot.query("SELECT age FROM patients")
+        if not age_data.empty:
             # Age distribution chart
-            age_data = pd.DataFrame(st.session_state.patients)
             fig = px.histogram(age_data, x='age', nbins=10, title="Patient Age Distribution")
             st.plotly_chart(fig, use_container_width=True)
             
             # Gender distribution
-            gender_counts = age_data['gender'].value_counts()
-            fig = px.pie(values=gender_counts.values, names=gender_counts.index, 
+            gender_counts = snapshot.query("SELECT gender, COUNT(*) AS count FROM patients GROUP BY gender")
+            fig = px.pie(gender_counts, values='count', names='gender', 
                          title="Patient Gender Distribution")
             st.plotly_chart(fig, use_container_width=True)
         else:
@@ -723,22 +1899,19 @@ def reports_page():
     with tab2:
         st.subheader("Financial Reports")
         
-        if st.session_state.bills:
-            # Revenue by month
-            bill_data = pd.DataFrame(st.session_state.bills)
-            bill_data['date'] = pd.to_datetime(bill_data['date'])
-            bill_data['month'] = bill_data['date'].dt.to_period('M')
-            
-            monthly_revenue = bill_data.groupby('month')['total_amount'].sum().reset_index()
-            monthly_revenue['month'] = monthly_revenue['month'].astype(str)
-            
+        # Revenue by month
+        monthly_revenue = snapshot.query('''
+            SELECT substr(date, 1, 7) AS month, SUM(total_amount) AS total_amount
+            FROM bills GROUP BY month ORDER BY month
+        ''')
+        if not monthly_revenue.empty:
             fig = px.bar(monthly_revenue, x='month', y='total_amount', 
                          title="Monthly Revenue", labels={'total_amount': 'Revenue ($)'})
             st.plotly_chart(fig, use_container_width=True)
             
             # Payment status
-            status_counts = bill_data['status'].value_counts()
-            fig = px.pie(values=status_counts.values, names=status_counts.index, 
+            status_counts = snapshot.query("SELECT status, COUNT(*) AS count FROM bills GROUP BY status")
+            fig = px.pie(status_counts, values='count', names='status', 
                          title="Payment Status Distribution")
             st.plotly_chart(fig, use_container_width=True)
         else:
@@ -747,18 +1920,18 @@ def reports_page():
     with tab3:
         st.subheader("Appointment Reports")
         
-        if st.session_state.appointments:
-            # Appointment status
-            appt_data = pd.DataFrame(st.session_state.appointments)
-            status_counts = appt_data['status'].value_counts()
-            
-            fig = px.pie(values=status_counts.values, names=status_counts.index, 
+        # Appointment status
+        status_counts = snapshot.query("SELECT status, COUNT(*) AS count FROM appointments GROUP BY status")
+        if not status_counts.empty:
+            fig = px.pie(status_counts, values='count', names='status', 
                          title="Appointment Status Distribution")
             st.plotly_chart(fig, use_container_width=True)
             
             # Appointments by date
-            appt_data['date'] = pd.to_datetime(appt_data['date'])
-            daily_appointments = appt_data.groupby('date').size().reset_index(name='count')
+            daily_appointments = snapshot.query(
+                "SELECT date, COUNT(*) AS count FROM appointments GROUP BY date ORDER BY date"
+            )
+            daily_appointments['date'] = pd.to_datetime(daily_appointments['date'])
             
             fig = px.line(daily_appointments, x='date', y='count', 
                          title="Daily Appointments Trend")
@@ -766,6 +1939,114 @@ def reports_page():
         else:
             st.info("No appointment data available for reports.")
 
+# Audit log page
+def audit_log_page():
+    st.title("🛡️ Audit Log")
+    
+    if st.session_state.user['role'] != 'admin':
+        st.error("Only administrators can view the audit log.")
+        return
+    
+    conn = sqlite3.connect('hospital.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT username FROM users ORDER BY username")
+    usernames = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        username = st.selectbox("User", [""] + usernames)
+        entity = st.selectbox("Entity", ["", "patient", "doctor", "appointment", "bill", "user", "database"])
+    
+    with col2:
+        action = st.selectbox("Action", ["", "create", "update_status", "restore", "merge"])
+        entity_id = st.number_input("Entity ID (0 = any)", min_value=0, value=0, step=1)
+    
+    with col3:
+        start_date = st.date_input("From", value=datetime.now().date() - timedelta(days=7))
+        end_date = st.date_input("To", value=datetime.now().date())
+    
+    audit_df = query_audit_log(username=username, entity=entity, action=action,
+                               entity_id=entity_id, start_date=start_date, end_date=end_date)
+    
+    if not audit_df.empty:
+        st.caption(f"Showing the {len(audit_df)} most recent matching events")
+        st.dataframe(audit_df, use_container_width=True, hide_index=True)
+    else:
+        st.info("No audit events match the selected filters.")
+
+# Backups page
+def backups_page():
+    st.title("💾 Backups")
+    
+    if st.session_state.user['role'] != 'admin':
+        st.error("Only administrators can manage backups.")
+        return
+    
+    scheduler = get_backup_scheduler()
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.metric("Backup Interval", f"{scheduler.interval / 3600:g} hours")
+        if st.button("Back Up Now"):
+            try:
+                with st.spinner("Taking snapshot..."):
+                    stats = scheduler.run_now()
+                st.success(f"Snapshot written to {stats['path']}")
+            except (sqlite3.Error, OSError, BackupError) as e:
+                st.error(f"Backup failed: {e}")
+    
+    with col2:
+        if scheduler.last_error:
+            st.error(f"Last backup failed: {scheduler.last_error}")
+        elif scheduler.last_result:
+            stats = scheduler.last_result
+            st.metric("Last Backup", scheduler.last_run.strftime('%Y-%m-%d %H:%M:%S'))
+            st.write(f"{stats['size_bytes'] / 1e6:,.1f} MB in {stats['seconds']:.2f} s "
+                     f"({stats['mb_per_second']:,.0f} MB/s), longest step "
+                     f"{stats['max_step_seconds'] * 1000:.1f} ms")
+        else:
+            st.info("No backup taken since the server started.")
+    
+    st.markdown("---")
+    st.subheader("Snapshots")
+    
+    snapshots = list_snapshots(scheduler.backup_dir)
+    if snapshots:
+        snapshot_df = pd.DataFrame([{
+            'Snapshot': os.path.basename(path),
+            'Size (MB)': round(os.path.getsize(path) / 1e6, 1),
+            'Taken': datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S')
+        } for path in snapshots])
+        st.dataframe(snapshot_df, use_container_width=True, hide_index=True)
+        
+        st.subheader("Restore")
+        selected_snapshot = st.selectbox("Select Snapshot", options=snapshots, format_func=os.path.basename)
+        confirm = st.checkbox("I understand this replaces all current data")
+        
+        if st.button("Restore Snapshot", disabled=not confirm):
+            try:
+                with st.spinner("Restoring..."):
+                    # Buffered audit events go in first; restore_database keeps audit_log rows newer than the snapshot
+                    get_audit_logger().flush()
+                    result = restore_database(selected_snapshot, backup_dir=scheduler.backup_dir)
+                audit('restore', 'database', after={'snapshot': os.path.basename(selected_snapshot),
+                                                    'safety_snapshot': result['safety_snapshot']})
+                # The snapshot may predate tables added since
+                init_db.clear()
+                init_db()
+                load_data()
+                get_analytics_snapshot().full_refresh()
+                get_reminder_scheduler().reload()
+                st.success(f"Database restored in {result['seconds']:.2f} s. "
+                           f"Previous data saved to {result['safety_snapshot']}")
+            except (sqlite3.Error, OSError, BackupError) as e:
+                st.error(f"Restore failed: {e}")
+    else:
+        st.info("No snapshots found.")
+
 # Main application
 def main():
     if not st.session_state.logged_in:
@@ -778,15 +2059,24 @@ def main():
             st.markdown("---")
             
             # Navigation menu
+            options = ["Dashboard", "Patient Management", "Doctor Management", 
+                       "Appointment Management", "Billing Management", "Reports"]
+            icons = ["house", "people", "person-badge", "calendar", "cash-coin", "bar-chart"]
+            if st.session_state.user['role'] == 'admin':
+                options += ["Audit Log", "Backups"]
+                icons += ["shield-check", "database"]
+            
             selected = option_menu(
                 menu_title="Navigation",
-                options=["Dashboard", "Patient Management", "Doctor Management", 
-                         "Appointment Management", "Billing Management", "Reports"],
-                icons=["house", "people", "person-badge", "calendar", "cash-coin", "bar-chart"],
+                options=options,
+                icons=icons,
                 default_index=0
             )
             
             st.markdown("---")
+            if st.session_state.user['role'] == 'admin':
+                interaction_timings_panel()
+            
             if st.button("Logout"):
                 st.session_state.logged_in = False
                 st.session_state.user = None
@@ -805,6 +2095,12 @@ def main():
             billing_management_page()
         elif selected == "Reports":
             reports_page()
+        elif selected == "Audit Log":
+            audit_log_page()
+        elif selected == "Backups":
+            backups_page()
+    
+    record_timing('full rerun', time.perf_counter() - script_started)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
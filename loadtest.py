@@ -0,0 +1,314 @@
+"""
+Headless load test for the Hospital Management System
+
+Simulates concurrent staff sessions with Streamlit's AppTest against a
+generated database and reports rerun latency, throughput and memory.
+AppTest keeps its runtime in a process-wide global, so every session runs
+in its own process; they share the database but not the app's
+st.cache_resource objects.
+
+Usage:
+    python loadtest.py [--sessions 10] [--iterations 5] [--patients 5000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hospital_management.py')
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+               "David", "Elizabeth", "William", "Susan", "Richard", "Jessica", "Joseph", "Sarah"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+              "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson"]
+SPECIALIZATIONS = ["Cardiology", "Dermatology", "Neurology", "Pediatrics", "Orthopedics", "General"]
+LOGIN_FLOWS = ['open app', 'login']  # run before the sessions start together, left out of throughput
+# Fragment each interaction reruns in a browser; under AppTest every click is a full-app run
+FRAGMENT_FLOWS = {
+    'search patients': 'search_patients_fragment',
+    'book appointment': 'schedule_appointment_form',
+    'update payment status': 'bill_records_fragment',
+}
+
+
+def app_driver(app_path):
+    # Executed by AppTest on every rerun. option_menu is a custom component
+    # AppTest cannot click, so instead of main() the harness picks the page
+    # through session state. run_path re-executes the module top level
+    # (page config, init_db, load_data) exactly like a real rerun does.
+    import runpy
+    import streamlit as st
+
+    app = runpy.run_path(app_path, run_name="loadtest")
+    if not st.session_state.logged_in:
+        app['login_page']()
+    else:
+        app[st.session_state.get('loadtest_page', 'dashboard_page')]()
+
+
+def generate_database(patients, doctors, appointments, bills):
+    # Tables already exist: the warm-up session ran init_db()
+    conn = sqlite3.connect('hospital.db')
+    today = datetime.now().date()
+
+    def random_name():
+        return f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}"
+
+    def random_date(days_back, days_ahead=0):
+        return (today + timedelta(days=random.randint(-days_back, days_ahead))).strftime('%Y-%m-%d')
+
+    conn.executemany('''
+        INSERT INTO patients (name, age, gender, address, phone, email, blood_group, medical_history)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((random_name(), random.randint(1, 95), random.choice(["Male", "Female", "Other"]),
+           f"{random.randint(1, 999)} Main St", f"555{random.randint(1000000, 9999999)}",
+           f"patient{i}@example.com", random.choice(["A+", "B+", "O+", "AB-"]), "")
+          for i in range(patients)))
+    conn.executemany('''
+        INSERT INTO doctors (name, specialization, phone, email, fee, schedule)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((random_name(), random.choice(SPECIALIZATIONS), f"555{random.randint(1000000, 9999999)}",
+           f"doctor{i}@example.com", random.choice([50.0, 100.0, 150.0]), "Mon-Fri 9AM-5PM")
+          for i in range(doctors)))
+    conn.executemany('''
+        INSERT INTO appointments (patient_id, doctor_id, date, time, reason, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((random.randint(1, patients), random.randint(1, doctors), random_date(180, 30),
+           f"{random.randint(8, 17):02d}:{random.choice(['00', '30'])}", "Checkup",
+           random.choice(["Scheduled", "Completed", "Cancelled"]))
+          for _ in range(appointments)))
+    conn.executemany('''
+        INSERT INTO bills (patient_id, doctor_fee, medicine_fee, room_charge, other_charges, total_amount, date, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((random.randint(1, patients), 100.0, 20.0, 0.0, 5.0, 125.0, random_date(365),
+           random.choice(["Pending", "Paid"]))
+          for _ in range(bills)))
+    conn.commit()
+    conn.close()
+
+
+def widget(elements, label):
+    return next(e for e in elements if e.label == label)
+
+
+class Session:
+    """One simulated staff member working through the realistic flows."""
+
+    def __init__(self, number, timeout, patients, bills):
+        self.number = number
+        self.patients = patients
+        self.bills = bills
+        self.at = AppTest.from_function(app_driver, args=(APP_PATH,), default_timeout=timeout)
+        self.timings = []           # (flow, seconds)
+        self.fragment_timings = []  # (flow, seconds spent inside the flow's fragment)
+
+    def run(self, flow):
+        # timed_fragment records each fragment's own run time, i.e. the work
+        # a fragment rerun does instead of the full rerun timed here
+        if flow in FRAGMENT_FLOWS:
+            self.at.session_state['interaction_timings'] = {}
+        started = time.perf_counter()
+        self.at.run()
+        self.timings.append((flow, time.perf_counter() - started))
+        if self.at.exception:
+            raise RuntimeError(f"session {self.number}, {flow}: {self.at.exception[0].message}")
+        if flow in FRAGMENT_FLOWS:
+            samples = self.at.session_state['interaction_timings'].get(FRAGMENT_FLOWS[flow])
+            if samples:
+                self.fragment_timings.append((flow, sum(samples)))
+
+    def open_page(self, page, flow):
+        self.at.session_state['loadtest_page'] = page
+        self.run(flow)
+
+    def login(self):
+        self.run('open app')
+        widget(self.at.text_input, "Username").input("admin")
+        widget(self.at.text_input, "Password").input("admin123")
+        widget(self.at.button, "Login").click()
+        self.run('login')
+
+    def search_patients(self):
+        self.open_page('patient_management_page', 'open patients')
+        widget(self.at.radio, "Search by").set_value("Name")
+        widget(self.at.text_input, "Search term").input(random.choice(LAST_NAMES)[:4])
+        self.run('search patients')
+
+    def book_appointment(self):
+        self.open_page('appointment_management_page', 'open appointments')
+        widget(self.at.selectbox, "Select Patient*").set_value(random.randint(1, self.patients))
+        widget(self.at.text_area, "Reason for Appointment*").input(f"Load test visit {self.number}")
+        widget(self.at.button, "Schedule Appointment").click()
+        self.run('book appointment')
+
+    def update_payment_status(self):
+        self.open_page('billing_management_page', 'open billing')
+        widget(self.at.selectbox, "Select Bill").set_value(random.randint(1, self.bills))
+        widget(self.at.selectbox, "Payment Status").set_value("Paid")
+        widget(self.at.button, "Update Payment Status").click()
+        self.run('update payment status')
+
+    def open_reports(self):
+        self.open_page('reports_page', 'open reports')
+
+    def work(self, iterations, start_barrier):
+        self.login()
+        # All sessions start their flows together once every process is up
+        start_barrier.wait()
+        for _ in range(iterations):
+            self.search_patients()
+            self.book_appointment()
+            self.update_payment_status()
+            self.open_reports()
+
+
+def warm_up(timeout, workdir):
+    # Creates the schema. Runs in a child process because AppTest swaps out
+    # sys.modules['__main__'], after which spawn cannot start session processes.
+    os.chdir(workdir)
+    AppTest.from_function(app_driver, args=(APP_PATH,), default_timeout=timeout).run()
+
+
+def run_session(number, iterations, timeout, patients, bills, workdir, start_barrier, results):
+    # Entry point of each session process
+    os.chdir(workdir)
+    session = Session(number, timeout, patients, bills)
+    error = None
+    try:
+        session.work(iterations, start_barrier)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        start_barrier.abort()  # do not leave the other sessions waiting
+    results.put((number, session.timings, session.fragment_timings, error, time.time()))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure_session_memory(count, timeout, patients, bills):
+    # Measured on extra sessions after the timed run so tracemalloc's
+    # overhead does not distort the latency numbers. One untimed session runs
+    # first so imports and st.cache_resource objects are not charged to the sessions.
+    warmup = Session("memory-warmup", timeout, patients, bills)
+    warmup.login()
+    warmup.open_reports()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    sessions = [Session(f"memory-{i}", timeout, patients, bills) for i in range(count)]
+    for session in sessions:
+        session.login()
+        session.open_reports()
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return memory / count
+
+
+def report_fragments(session_timings, session_fragment_timings):
+    if not any(session_fragment_timings):
+        return  # an app without timed fragments
+    full, fragment = {}, {}
+    for timings in session_timings:
+        for flow, seconds in timings:
+            full.setdefault(flow, []).append(seconds)
+    for timings in session_fragment_timings:
+        for flow, seconds in timings:
+            fragment.setdefault(flow, []).append(seconds)
+
+    print(f"\n{'Interaction':<24}{'Full rerun p50 ms':>19}{'Fragment p50 ms':>17}{'Speed-up':>10}")
+    for flow in FRAGMENT_FLOWS:
+        if flow in fragment:
+            full_ms = percentile(sorted(full[flow]), 50) * 1000
+            fragment_ms = percentile(sorted(fragment[flow]), 50) * 1000
+            print(f"{flow:<24}{full_ms:>19.0f}{fragment_ms:>17.0f}{full_ms / fragment_ms:>9.0f}x")
+
+
+def report(session_timings, wall_seconds, memory_per_session):
+    by_flow = {}
+    for timings in session_timings:
+        for flow, seconds in timings:
+            by_flow.setdefault(flow, []).append(seconds)
+    all_timings = sorted(s for timings in by_flow.values() for s in timings)
+
+    print(f"\n{'Flow':<24}{'Reruns':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for flow, timings in list(by_flow.items()) + [('all reruns', all_timings)]:
+        timings = sorted(timings)
+        print(f"{flow:<24}{len(timings):>8}{percentile(timings, 50) * 1000:>10.0f}"
+              f"{percentile(timings, 95) * 1000:>10.0f}{percentile(timings, 99) * 1000:>10.0f}")
+
+    print(f"\nSessions:             {len(session_timings)}")
+    print(f"Wall time:            {wall_seconds:.1f} s")
+    measured = sum(len(timings) for flow, timings in by_flow.items() if flow not in LOGIN_FLOWS)
+    print(f"Throughput:           {measured / wall_seconds:.1f} reruns/s")
+    print(f"Memory per session:   {memory_per_session / 1e6:.1f} MB (Python heap, tracemalloc)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test")
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=5, help="flow rounds per session")
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--doctors', type=int, default=50)
+    parser.add_argument('--appointments', type=int, default=20000)
+    parser.add_argument('--bills', type=int, default=10000)
+    parser.add_argument('--timeout', type=float, default=120, help="seconds allowed per rerun")
+    args = parser.parse_args()
+
+    # The app opens hospital.db relative to the working directory. The
+    # directory is kept afterwards: the app's audit logger flushes into it
+    # at exit, and the generated database can be inspected.
+    workdir = tempfile.mkdtemp(prefix="hms-loadtest-")
+    os.chdir(workdir)
+
+    # spawn, not fork: the app starts background threads at import
+    context = multiprocessing.get_context('spawn')
+
+    print(f"Creating schema and generating data in {workdir} ...")
+    warmup = context.Process(target=warm_up, args=(args.timeout, workdir))
+    warmup.start()
+    warmup.join()
+    generate_database(args.patients, args.doctors, args.appointments, args.bills)
+
+    start_barrier = context.Barrier(args.sessions + 1)
+    results = context.Queue()
+    processes = [context.Process(target=run_session, args=(i, args.iterations, args.timeout, args.patients,
+                                                            args.bills, workdir, start_barrier, results))
+                 for i in range(args.sessions)]
+    for process in processes:
+        process.start()
+
+    print(f"Running {args.sessions} sessions x {args.iterations} iterations...")
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        pass  # a session failed during login, its error is reported below
+    started = time.time()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    wall_seconds = max(finished for _, _, _, _, finished in outcomes) - started
+
+    memory_per_session = measure_session_memory(min(3, args.sessions), args.timeout, args.patients, args.bills)
+
+    report([timings for _, timings, _, _, _ in outcomes], wall_seconds, memory_per_session)
+    report_fragments([timings for _, timings, _, _, _ in outcomes],
+                     [fragment_timings for _, _, fragment_timings, _, _ in outcomes])
+    for number, _, _, error, _ in sorted(outcomes):
+        if error:
+            print(f"ERROR: session {number}: {error}")
+
+
+if __name__ == "__main__":
+    main()